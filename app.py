@@ -1,35 +1,87 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-from flask_pymongo import PyMongo
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, session, redirect, url_for, flash
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timezone
+import hashlib
 import json
+import os
+import sys
 from config import Config
-from mqtt_client import MQTTClient
-from openai_service import OpenAIService
-import threading
-import paho.mqtt.publish as mqtt_publish
+from serialization import FastJSONProvider
+from services import Services, current_services, service_proxy
+from diagnostics import init_diagnostics, token_authorized
+from ratelimit import retry_after_header
+import topics
 
-app = Flask(__name__)
-app.config.from_object(Config)
+bp = Blueprint('main', __name__)
 
-# Initialize MongoDB
-mongo = PyMongo(app)
+# Services are created on first use (and again in forked workers); see services.py
+mongo = service_proxy('mongo')
+device_registry = service_proxy('device_registry')
+openai_service = service_proxy('openai_service')
+mqtt_client = service_proxy('mqtt_client')
+vibration_downlink = service_proxy('vibration_downlink')
+archiver = service_proxy('archiver')
+history_reader = service_proxy('history_reader')
+rate_limiter = service_proxy('rate_limiter')
+llm_limiter = service_proxy('llm_limiter')
 
-# Initialize services
-mqtt_client = MQTTClient(app, mongo)
-openai_service = OpenAIService()
+def create_app(config_object=Config):
+    """Build the Flask app; no network connections or heavy imports happen here"""
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    # ObjectId/datetime are serialized natively, so documents can be returned as-is
+    app.json = FastJSONProvider(app)
+    # Registers nothing unless DIAGNOSTICS_ENABLED
+    init_diagnostics(app)
+    
+    services = Services(app)
+    if app.config['START_BACKGROUND_SERVICES']:
+        # Single-process deployments only: every process that starts these
+        # subscribes and archives on its own. Use the worker command instead
+        # when serving with more than one web process.
+        app.before_request(services.start_background)
+    
+    @app.cli.command('worker')
+    def worker_command():
+        """Run the MQTT subscriber and archive job (one per deployment)"""
+        sys.exit(services.run_worker())
+    
+    app.register_blueprint(bp)
+    return app
 
-# Start MQTT client in background thread
-mqtt_thread = threading.Thread(target=mqtt_client.start, daemon=True)
-mqtt_thread.start()
+def too_many_requests(message, retry_after):
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
 
-@app.route('/')
+def throttled(endpoint_class):
+    """429 response if the user is over their limit for endpoint_class, else None"""
+    allowed, retry_after = rate_limiter.check(session['user_id'], endpoint_class)
+    if allowed:
+        return None
+    return too_many_requests('Too many requests. Please slow down and try again shortly.', retry_after)
+
+def acquire_llm(endpoint_class):
+    """A lease on an LLM slot, or None; a shed request gets its rate-limit token back"""
+    lease = llm_limiter.try_acquire()
+    if lease is None:
+        rate_limiter.refund(session['user_id'], endpoint_class)
+    return lease
+
+# Fields returned by /api/sensor-data?points=N
+CHART_FIELDS = ['timestamp', 'role', 'device_id', 'temperature', 'light', 'moisture', 'moisture_status', 'ir_sensor']
+
+def llm_busy():
+    return too_many_requests('The assistant is busy right now. Please try again in a moment.', llm_limiter.retry_after)
+
+@bp.route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.login'))
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     if request.method == 'POST':
         data = request.get_json()
@@ -56,11 +108,11 @@ def signup():
         session['user_id'] = str(user['_id'])
         session['username'] = username
         
-        return jsonify({'success': True, 'redirect': url_for('dashboard')}), 200
+        return jsonify({'success': True, 'redirect': url_for('main.dashboard')}), 200
     
     return render_template('signup.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         data = request.get_json()
@@ -75,36 +127,39 @@ def login():
         if user and check_password_hash(user['password'], password):
             session['user_id'] = str(user['_id'])
             session['username'] = username
-            return jsonify({'success': True, 'redirect': url_for('dashboard')}), 200
+            return jsonify({'success': True, 'redirect': url_for('main.dashboard')}), 200
         else:
             return jsonify({'error': 'Invalid credentials'}), 401
     
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     # Get recent sensor data
     recent_data = list(mongo.db.sensor_data.find(
         {'user_id': session['user_id']}
     ).sort('timestamp', -1).limit(10))
     
-    # Convert ObjectId to string for JSON serialization
-    for data in recent_data:
-        data['_id'] = str(data['_id'])
-        if 'timestamp' in data:
-            data['timestamp'] = data['timestamp'].isoformat()
-    
     return render_template('dashboard.html', recent_data=recent_data)
 
-@app.route('/api/sensor-data', methods=['GET'])
+def parse_utc(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime (as stored in MongoDB)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@bp.route('/api/sensor-data', methods=['GET'])
 def get_sensor_data():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
@@ -113,11 +168,31 @@ def get_sensor_data():
     role = request.args.get('role', 'user')
     limit = int(request.args.get('limit', 100))
     
+    # Optional server-side downsampling to at most `points` rows, reading
+    # only the fields the chart and current-readings panel use
+    points = request.args.get('points', type=int)
+    projection = None
+    if points is not None:
+        if points < 3 or points > current_app.config['CHART_MAX_POINTS']:
+            return jsonify({'error': f"points must be between 3 and {current_app.config['CHART_MAX_POINTS']}"}), 400
+        limit = min(limit, current_app.config['CHART_MAX_SOURCE_READINGS'])
+        projection = CHART_FIELDS
+    
     query = {'user_id': user_id}
     if role != 'all':
         query['role'] = role
     
-    data = list(mongo.db.sensor_data.find(query).sort('timestamp', -1).limit(limit))
+    # Optional ISO 8601 time range; old ranges are served from the archive
+    try:
+        start = parse_utc(request.args.get('start'))
+        end = parse_utc(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO 8601 timestamps'}), 400
+    
+    if start or end:
+        data = history_reader.find_readings(user_id, query.get('role'), start, end, limit, projection)
+    else:
+        data = list(mongo.db.sensor_data.find(query, projection).sort('timestamp', -1).limit(limit))
     
     # Debug logging
     print(f"[API] Sensor data query - User ID: {user_id}, Role: {role}")
@@ -132,14 +207,13 @@ def get_sensor_data():
             roles_found = [d.get('role', 'N/A') for d in all_user_data]
             print(f"[API] No data for role '{role}', but found data with roles: {set(roles_found)}")
     
-    for item in data:
-        item['_id'] = str(item['_id'])
-        if 'timestamp' in item:
-            item['timestamp'] = item['timestamp'].isoformat()
+    if points is not None:
+        from decimation import decimate_readings  # numpy, only needed for chart ranges
+        data = decimate_readings(data, points)
     
     return jsonify(data)
 
-@app.route('/api/age-config', methods=['GET', 'POST'])
+@bp.route('/api/age-config', methods=['GET', 'POST'])
 def age_config():
     """Get or save age configuration for roles"""
     if 'user_id' not in session:
@@ -188,11 +262,15 @@ def age_config():
         
         return jsonify({'success': True, 'ages': ages})
 
-@app.route('/api/recommendations', methods=['POST'])
+@bp.route('/api/recommendations', methods=['POST'])
 def get_recommendations():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    limited = throttled('recommendations')
+    if limited:
+        return limited
+    
     data = request.get_json()
     role = data.get('role', 'user')
     
@@ -211,15 +289,21 @@ def get_recommendations():
     if user_settings and 'ages' in user_settings:
         age = user_settings['ages'].get(role)
     
-    # Generate recommendations using OpenAI
-    recommendations = openai_service.get_recommendations(
-        temperature=latest_data.get('temperature', 0),
-        light=latest_data.get('light', 0),
-        moisture=latest_data.get('moisture', 0),
-        moisture_status=latest_data.get('moisture_status', 'normal'),
-        role=role,
-        age=age
-    )
+    # Generate recommendations using OpenAI, shedding load past the concurrency cap
+    lease = acquire_llm('recommendations')
+    if lease is None:
+        return llm_busy()
+    try:
+        recommendations = openai_service.get_recommendations(
+            temperature=latest_data.get('temperature', 0),
+            light=latest_data.get('light', 0),
+            moisture=latest_data.get('moisture', 0),
+            moisture_status=latest_data.get('moisture_status', 'normal'),
+            role=role,
+            age=age
+        )
+    finally:
+        llm_limiter.release(lease)
     
     # Store recommendation
     recommendation_doc = {
@@ -234,11 +318,15 @@ def get_recommendations():
     
     return jsonify(recommendations)
 
-@app.route('/api/chat', methods=['POST'])
+@bp.route('/api/chat', methods=['POST'])
 def chat():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    limited = throttled('chat')
+    if limited:
+        return limited
+    
     data = request.get_json()
     message = data.get('message', '')
     
@@ -251,11 +339,26 @@ def chat():
         sort=[('timestamp', -1)]
     )
     
-    response = openai_service.chat(message, recent_data)
+    lease = acquire_llm('chat')
+    if lease is None:
+        return llm_busy()
+    try:
+        response = openai_service.chat(message, recent_data, user_id=session['user_id'])
+    finally:
+        llm_limiter.release(lease)
     
     return jsonify({'response': response})
 
-@app.route('/api/user-id', methods=['GET'])
+@bp.route('/api/chat/reset', methods=['POST'])
+def reset_chat():
+    """Start a new chatbot conversation"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    openai_service.clear_conversation(session['user_id'])
+    return jsonify({'success': True})
+
+@bp.route('/api/user-id', methods=['GET'])
 def get_user_id():
     """Get the current logged-in user's ID for MQTT testing"""
     if 'user_id' not in session:
@@ -266,29 +369,75 @@ def get_user_id():
         'username': session.get('username', '')
     })
 
-@app.route('/api/set-role', methods=['POST'])
+def device_command_topics(user_id, channel, device_id=None):
+    """Command topics for a user's devices (optionally one device), plus the legacy shared topic"""
+    devices = device_registry.devices_for_user(user_id)
+    command_topics = [
+        topics.device_topic(current_app.config['MQTT_TOPIC_ROOT'], user_id, device['device_id'], channel)
+        for device in devices
+        if device_id is None or device['device_id'] == device_id
+    ]
+    if current_app.config['MQTT_LEGACY_TOPICS'] and device_id is None:
+        command_topics.append(f"{current_app.config['MQTT_TOPIC_ROOT']}/{channel}")
+    return command_topics
+
+@bp.route('/api/devices', methods=['GET', 'POST'])
+def devices():
+    """List or register the current user's combs"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    if request.method == 'GET':
+        return jsonify(device_registry.devices_for_user(user_id))
+    
+    data = request.get_json()
+    device_id = (data.get('device_id') or '').strip()
+    if not device_id or '/' in device_id or '+' in device_id or '#' in device_id:
+        return jsonify({'error': 'Invalid device_id'}), 400
+    
+    if not device_registry.register(user_id, device_id, data.get('name')):
+        return jsonify({'error': 'Device is registered to another account'}), 409
+    
+    return jsonify({'success': True, 'device_id': device_id})
+
+@bp.route('/api/devices/<device_id>', methods=['DELETE'])
+def remove_device(device_id):
+    """Unregister one of the current user's combs"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if not device_registry.remove(session['user_id'], device_id):
+        return jsonify({'error': 'Device not found'}), 404
+    
+    return jsonify({'success': True})
+
+@bp.route('/api/set-role', methods=['POST'])
 def set_role():
     """Send role selection to ESP32 via MQTT"""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    limited = throttled('set_role')
+    if limited:
+        return limited
+    
     data = request.get_json()
     role = data.get('role', '')
     
     if role not in ['mother', 'father', 'child']:
         return jsonify({'error': 'Invalid role. Must be mother, father, or child'}), 400
     
+    command_topics = device_command_topics(session['user_id'], topics.ROLE, data.get('device_id'))
+    if not command_topics:
+        return jsonify({'error': 'No devices registered. Register your comb on the dashboard first.'}), 404
+    
     try:
-        topic = 'smartcomb/role'  # Match ESP32 subscription topic
-        print(f"[API] Publishing role '{role}' to topic: {topic}")
+        print(f"[API] Publishing role '{role}' to topics: {command_topics}")
         
-        # Publish role to MQTT topic that ESP32 subscribes to
-        mqtt_publish.single(
-            topic,
-            role,
-            hostname=app.config['MQTT_BROKER'],
-            port=app.config['MQTT_PORT']
-        )
+        # Publish role to the per-device topics the ESP32s subscribe to
+        current_services().publish([{'topic': topic, 'payload': role} for topic in command_topics])
         
         print(f"[API] Role '{role}' successfully published to MQTT")
         
@@ -296,7 +445,7 @@ def set_role():
             'success': True,
             'message': f'Role "{role}" sent to device',
             'role': role,
-            'topic': topic
+            'topics': command_topics
         })
     except Exception as e:
         print(f"[API] Error publishing role: {str(e)}")
@@ -304,12 +453,16 @@ def set_role():
             'error': f'Failed to send role to device: {str(e)}'
         }), 500
 
-@app.route('/api/vibration', methods=['POST'])
+@bp.route('/api/vibration', methods=['POST'])
 def control_vibration():
     """Send vibration motor control command to ESP32 via MQTT"""
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
+    limited = throttled('vibration')
+    if limited:
+        return limited
+    
     data = request.get_json()
     command = data.get('command', '').lower()
     intensity = data.get('intensity', None)
@@ -317,47 +470,37 @@ def control_vibration():
     if command not in ['on', 'off', '1', '0', 'true', 'false']:
         return jsonify({'error': 'Invalid command. Must be on, off, 1, 0, true, or false'}), 400
     
-    try:
-        topic = 'smartcomb/vibration'  # Match ESP32 subscription topic
-        
-        # If turning on and intensity is provided, send intensity value
-        if command in ['on', '1', 'true'] and intensity is not None:
-            try:
-                intensity_val = int(intensity)
-                if intensity_val < 0 or intensity_val > 255:
-                    return jsonify({'error': 'Intensity must be between 0 and 255'}), 400
-                payload = f"{intensity_val}"
-                print(f"[API] Publishing vibration intensity '{intensity_val}' to topic: {topic}")
-            except (ValueError, TypeError):
-                payload = command
-                print(f"[API] Publishing vibration command '{command}' to topic: {topic}")
-        else:
+    command_topics = device_command_topics(session['user_id'], topics.VIBRATION, data.get('device_id'))
+    if not command_topics:
+        return jsonify({'error': 'No devices registered. Register your comb on the dashboard first.'}), 404
+    topic = ', '.join(command_topics)
+    
+    # If turning on and intensity is provided, send intensity value
+    if command in ['on', '1', 'true'] and intensity is not None:
+        try:
+            intensity_val = int(intensity)
+            if intensity_val < 0 or intensity_val > 255:
+                return jsonify({'error': 'Intensity must be between 0 and 255'}), 400
+            payload = f"{intensity_val}"
+        except (ValueError, TypeError):
             payload = command
-            print(f"[API] Publishing vibration command '{command}' to topic: {topic}")
-        
-        # Publish vibration command/intensity to MQTT topic that ESP32 subscribes to
-        mqtt_publish.single(
-            topic,
-            payload,
-            hostname=app.config['MQTT_BROKER'],
-            port=app.config['MQTT_PORT']
-        )
-        
-        print(f"[API] Vibration command/intensity successfully published to MQTT")
-        
-        return jsonify({
-            'success': True,
-            'message': f'Vibration motor command "{command}" sent to device',
-            'command': command,
-            'intensity': intensity
-        })
-    except Exception as e:
-        print(f"[API] Error publishing vibration command: {str(e)}")
-        return jsonify({
-            'error': f'Failed to send vibration command to device: {str(e)}'
-        }), 500
+    else:
+        payload = command
+    
+    # Queue for the background worker's publisher: rapid slider updates
+    # collapse into one retained publish of the latest value per device
+    print(f"[API] Queueing vibration payload '{payload}' for topic: {topic}")
+    for t in command_topics:
+        vibration_downlink.submit(t, payload)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Vibration motor command "{command}" sent to device',
+        'command': command,
+        'intensity': intensity
+    })
 
-@app.route('/api/recommend-intensity', methods=['GET'])
+@bp.route('/api/recommend-intensity', methods=['GET'])
 def recommend_intensity():
     """Get recommended vibration intensity based on role and age"""
     if 'user_id' not in session:
@@ -444,7 +587,90 @@ def get_intensity_recommendation_text(role, age, intensity):
     
     return f"Recommended: {intensity_percent}%"
 
-@app.route('/api/debug-data', methods=['GET'])
+ROLES = ['mother', 'father', 'child']
+
+@bp.route('/api/household', methods=['GET'])
+def household():
+    """Single snapshot of ages, recommended intensities and latest readings per role
+
+    Carries an ETag built from the newest reading id, the settings update
+    time and the archive watermark, so unchanged snapshots are answered
+    with 304 Not Modified before any of the per-role queries run. Nothing
+    in the snapshot depends on how many readings are stored, so readings
+    expiring cannot leave a 304 stale.
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    newest = mongo.db.sensor_data.find_one({'user_id': user_id}, {'_id': 1}, sort=[('_id', -1)])
+    user_settings = mongo.db.user_settings.find_one({'user_id': user_id})
+    updated_at = user_settings.get('updated_at') if user_settings else None
+    archive_state = mongo.db.archive_state.find_one({'user_id': user_id}, {'archived_until': 1})
+    archived_until = archive_state.get('archived_until') if archive_state else None
+    
+    etag_source = ':'.join([
+        user_id,
+        str(newest['_id']) if newest else '',
+        updated_at.isoformat() if updated_at else '',
+        archived_until.isoformat() if archived_until else ''
+    ])
+    etag = hashlib.sha1(etag_source.encode('utf-8')).hexdigest()
+    
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    ages = {'mother': None, 'father': None, 'child': None}
+    if user_settings and 'ages' in user_settings:
+        ages.update(user_settings['ages'])
+    
+    roles = {}
+    for role in ROLES:
+        latest = mongo.db.sensor_data.find_one(
+            {'user_id': user_id, 'role': role},
+            sort=[('timestamp', -1)]
+        )
+        
+        intensity = calculate_recommended_intensity(role, ages[role])
+        roles[role] = {
+            'age': ages[role],
+            'intensity': intensity,
+            'recommendation': get_intensity_recommendation_text(role, ages[role], intensity),
+            'latest': latest
+        }
+    
+    response = jsonify({
+        'user_id': user_id,
+        'username': session.get('username', ''),
+        'ages': ages,
+        'roles': roles
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@bp.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for the service components, for operators holding the diagnostics token"""
+    if not token_authorized(current_app.config['DIAGNOSTICS_TOKEN']):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return jsonify({
+        'openai': openai_service.metrics(),
+        'mqtt': mqtt_client.metrics(),
+        'retention': archiver.metrics(),
+        'vibration_downlink': vibration_downlink.metrics(),
+        'admission': {
+            'rate_limits': rate_limiter.metrics(),
+            'llm_concurrency': llm_limiter.metrics()
+        }
+    })
+
+@bp.route('/api/debug-data', methods=['GET'])
 def debug_data():
     """Debug endpoint to check what data exists in database"""
     if 'user_id' not in session:
@@ -453,7 +679,10 @@ def debug_data():
     user_id = session['user_id']
     
     # Get all data for this user
-    all_data = list(mongo.db.sensor_data.find({'user_id': user_id}).sort('timestamp', -1).limit(20))
+    all_data = list(mongo.db.sensor_data.find(
+        {'user_id': user_id},
+        {'_id': 0, 'role': 1, 'timestamp': 1, 'temperature': 1, 'light': 1, 'moisture': 1}
+    ).sort('timestamp', -1).limit(20))
     
     # Group by role
     roles_data = {}
@@ -462,7 +691,7 @@ def debug_data():
         if role not in roles_data:
             roles_data[role] = []
         roles_data[role].append({
-            'timestamp': item.get('timestamp', '').isoformat() if hasattr(item.get('timestamp', ''), 'isoformat') else str(item.get('timestamp', '')),
+            'timestamp': item.get('timestamp', ''),
             'temperature': item.get('temperature', 0),
             'light': item.get('light', 0),
             'moisture': item.get('moisture', 0)
@@ -476,5 +705,12 @@ def debug_data():
     })
 
 if __name__ == '__main__':
+    app = create_app()
+    if sys.argv[1:] == ['worker']:
+        sys.exit(app.extensions['smartcomb'].run_worker())
+    # Development server: web and background services in one process. The
+    # reloader runs this file twice; only its child process serves requests.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        app.extensions['smartcomb'].start_background()
     app.run(debug=True, host='0.0.0.0', port=4000)
 
@@ -0,0 +1,360 @@
+"""
+HTTP API Benchmark
+Seeds a local MongoDB with users and sensor readings, starts the app
+under a real WSGI server in a subprocess (gunicorn if installed,
+otherwise threaded werkzeug; see bench_server.py), logs in over HTTP as
+the seeded users and drives the authenticated routes at a configurable
+concurrency, recording p50/p95/p99 latency and throughput per route.
+OpenAIService is replaced by a stub in the server so /api/recommendations
+measures only this app.
+
+The load generator runs in this process with one keep-alive connection
+per concurrent client, so the client never shares a GIL with the server.
+
+Results are written as JSON and can be compared across commits.
+
+Usage:
+    # Seed 50 users / 2M readings and run every route for 20s at concurrency 8
+    python benchmarks/bench_http.py --users 50 --readings 2000000 --duration 20 --concurrency 8
+
+    # Re-run against the existing data and compare with an earlier result
+    python benchmarks/bench_http.py --no-seed --out after.json --compare before.json
+"""
+
+import argparse
+import http.client
+import importlib.util
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from serialization import dumps, dumps_bytes, loads
+
+ROLES = ['mother', 'father', 'child']
+
+# Routes to drive: name -> (method, path template, JSON body)
+ROUTES = {
+    'sensor_data': ('GET', '/api/sensor-data?role={role}&limit=100', None),
+    'sensor_data_chart': ('GET', '/api/sensor-data?role={role}&limit=10000&points=200', None),
+    'dashboard': ('GET', '/dashboard', None),
+    'recommend_intensity': ('GET', '/api/recommend-intensity?role={role}', None),
+    'age_config': ('GET', '/api/age-config', None),
+    'household': ('GET', '/api/household', None),
+    'recommendations': ('POST', '/api/recommendations', {'role': '{role}'}),
+}
+
+def configure_environment(mongo_uri, llm_latency):
+    """Config for create_app() here and in the server, without the MQTT subscriber or archive job"""
+    os.environ['MONGODB_URI'] = mongo_uri
+    os.environ['BENCH_LLM_LATENCY'] = str(llm_latency)
+    os.environ['START_BACKGROUND_SERVICES'] = 'false'
+    # Measure the routes themselves, not the per-user admission limits
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    os.environ['LLM_MAX_CONCURRENCY'] = '0'
+    os.environ['OPENAI_API_KEY'] = ''
+    os.environ['ARCHIVE_INTERVAL'] = '0'
+    # Keep seeded readings from being expired by the TTL index mid-run
+    os.environ['SENSOR_DATA_RETENTION_DAYS'] = '0'
+
+BENCH_PASSWORD = 'benchpass'
+
+def seed(db, users, readings, batch_size=10000):
+    """Create users, age settings and readings spread across roles"""
+    from bson import ObjectId
+    from werkzeug.security import generate_password_hash
+
+    print(f"Seeding {users} users and {readings:,} readings...")
+    db.users.delete_many({'username': {'$regex': '^bench_'}})
+    password = generate_password_hash(BENCH_PASSWORD)
+    user_docs = [{
+        '_id': ObjectId(),
+        'username': f'bench_{i}',
+        'email': f'bench_{i}@example.com',
+        'password': password,
+        'created_at': datetime.utcnow()
+    } for i in range(users)]
+    db.users.insert_many(user_docs)
+    user_ids = [str(u['_id']) for u in user_docs]
+
+    db.user_settings.insert_many([{
+        'user_id': user_id,
+        'ages': {'mother': random.randint(25, 60), 'father': random.randint(25, 60), 'child': random.randint(1, 16)},
+        'updated_at': datetime.utcnow()
+    } for user_id in user_ids])
+
+    per_user = readings // users
+    now = datetime.utcnow()
+    batch = []
+    inserted = 0
+    started = time.perf_counter()
+    for user_id in user_ids:
+        device_id = user_id[-8:]
+        for i in range(per_user):
+            moisture = random.uniform(0, 100)
+            batch.append({
+                'user_id': user_id,
+                'device_id': device_id,
+                'role': ROLES[i % 3],
+                'temperature': round(random.uniform(20.0, 38.0), 1),
+                'light': random.uniform(0, 100),
+                'moisture': moisture,
+                'moisture_status': 'dry' if moisture < 30 else 'oily' if moisture > 70 else 'normal',
+                'ir_sensor': 1,
+                'timestamp': now - timedelta(seconds=2 * (per_user - i))
+            })
+            if len(batch) >= batch_size:
+                db.sensor_data.insert_many(batch, ordered=False)
+                inserted += len(batch)
+                batch = []
+                if inserted % (batch_size * 20) == 0:
+                    print(f"  {inserted:,} readings ({inserted / (time.perf_counter() - started):,.0f}/s)")
+    if batch:
+        db.sensor_data.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    print(f"Seeded {inserted:,} readings in {time.perf_counter() - started:.1f}s")
+    return [u['username'] for u in user_docs]
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(server, port, workers, threads, log):
+    """The app under gunicorn or werkzeug in a subprocess; returns (process, description)"""
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                   '-b', f'127.0.0.1:{port}', '--chdir', BENCH_DIR, 'bench_server:create_bench_app()']
+        description = f'gunicorn -w {workers} --threads {threads}'
+    else:
+        command = [sys.executable, os.path.join(BENCH_DIR, 'bench_server.py'), '--port', str(port)]
+        description = 'werkzeug (threaded)'
+    process = subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    return process, description
+
+def wait_for_server(process, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}; see --server-log")
+        try:
+            status, _ = HTTPSession('127.0.0.1', port).request('GET', '/login')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not answer on port {port} within {timeout:.0f}s")
+
+class HTTPSession:
+    """One keep-alive connection with the Flask session cookie"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        data = None
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if body is not None:
+            data = dumps_bytes(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+        except (http.client.HTTPException, OSError):
+            # Server closed the keep-alive connection; reconnect for the next request
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, payload
+
+    def login(self, username):
+        status, payload = self.request('POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"Login as {username} failed with HTTP {status}: {payload[:200]!r}")
+
+def run_route(sessions, method, path, body, duration):
+    """Hammer one route from one thread per session for `duration` seconds"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(session):
+        nonlocal errors
+        local = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            role = random.choice(ROLES)
+            url = path.format(role=role)
+            payload = {k: v.format(role=role) for k, v in body.items()} if body else None
+            started = time.perf_counter()
+            try:
+                status, _ = session.request(method, url, payload)
+            except (http.client.HTTPException, OSError):
+                status = 599
+            local.append(time.perf_counter() - started)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        list(pool.map(worker, sessions))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 1),
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'rb') as f:
+        baseline = loads(f.read())
+    print("=" * 72)
+    print(f"Compared with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    print(f"{'route':>20} {'p50 ms':>16} {'p99 ms':>16} {'rps':>18}")
+    for name, current in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        def delta(key):
+            old, new = before[key], current[key]
+            change = (new - old) / old * 100 if old else 0.0
+            return f"{new:>8} ({change:+.0f}%)"
+        print(f"{name:>20} {delta('p50_ms'):>16} {delta('p99_ms'):>16} {delta('throughput_rps'):>18}")
+
+def run_routes(args, sessions, db, usernames, server_description):
+    """Run every selected route in turn; returns the results document"""
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow(),
+            'python': platform.python_version(),
+            'server': server_description,
+            'concurrency': args.concurrency,
+            'duration_per_route': args.duration,
+            'users': len(usernames),
+            'readings': db.sensor_data.estimated_document_count(),
+            'llm_latency': args.llm_latency
+        },
+        'routes': {}
+    }
+
+    print("=" * 72)
+    print(f"{'route':>20} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in args.routes:
+        method, path, body = ROUTES[name]
+        stats = run_route(sessions, method, path, body, args.duration)
+        results['routes'][name] = stats
+        print(f"{name:>20} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>9} "
+              f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Flask API routes against a local MongoDB')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/smartcomb_bench')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--readings', type=int, default=1000000, help='Total readings to seed')
+    parser.add_argument('--no-seed', action='store_true', help='Reuse data from a previous run')
+    parser.add_argument('--allow-drop', action='store_true',
+                        help="Allow seeding (which drops collections) in a database not named *bench*")
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients, each with its own connection and login')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'],
+                        default='gunicorn' if importlib.util.find_spec('gunicorn') else 'werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker')
+    parser.add_argument('--server-log', help='Write server output here (default: discarded)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per route')
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Simulated OpenAI latency in seconds')
+    parser.add_argument('--out', default='bench_http_results.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    configure_environment(args.mongo_uri, args.llm_latency)
+    # Only for seeding and indexes; requests are served by the server subprocess
+    from app import create_app
+    services = create_app().extensions['smartcomb']
+    services.init_storage()
+    db = services.mongo.db
+
+    if args.no_seed:
+        usernames = [u['username'] for u in db.users.find({'username': {'$regex': '^bench_'}}, {'username': 1})]
+        if not usernames:
+            parser.error('No seeded users found; run without --no-seed first')
+    else:
+        if 'bench' not in db.name and not args.allow_drop:
+            parser.error(f"Refusing to drop collections in '{db.name}'; use a *bench* database or --allow-drop")
+        db.sensor_data.drop()
+        db.user_settings.drop()
+        db.recommendations.drop()
+        usernames = seed(db, args.users, args.readings)
+        services.init_storage()
+
+    port = free_port()
+    log = open(args.server_log, 'wb') if args.server_log else subprocess.DEVNULL
+    process, server_description = start_server(args.server, port, args.workers, args.threads, log)
+    try:
+        wait_for_server(process, port)
+        sessions = [HTTPSession('127.0.0.1', port) for _ in range(args.concurrency)]
+        for i, session in enumerate(sessions):
+            session.login(usernames[i % len(usernames)])
+        results = run_routes(args, sessions, db, usernames, server_description)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if args.server_log:
+            log.close()
+
+    with open(args.out, 'w') as f:
+        f.write(dumps(results))
+    print(f"\nResults written to {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
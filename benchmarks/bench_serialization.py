@@ -0,0 +1,84 @@
+"""
+Serialization Benchmark
+Compares the old response path (per-row str()/isoformat() conversion loop +
+stdlib json) with the serialization module, for typical sensor-data
+response sizes. Also compares MQTT payload decoding.
+
+Usage:
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --sizes 10 100 1000 --repeat 500
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization
+
+def make_documents(count):
+    """Documents shaped like sensor_data rows as returned by PyMongo"""
+    now = datetime.utcnow()
+    return [{
+        '_id': ObjectId(),
+        'user_id': '6912bf7e2662f139fcd0db53',
+        'role': random.choice(['mother', 'father', 'child']),
+        'temperature': round(random.uniform(20.0, 35.0), 1),
+        'light': random.uniform(0, 100),
+        'moisture': random.uniform(0, 100),
+        'moisture_status': random.choice(['dry', 'normal', 'oily']),
+        'ir_sensor': 1,
+        'timestamp': now - timedelta(seconds=i * 2)
+    } for i in range(count)]
+
+def old_path(documents):
+    # Copy first: the old code mutated the documents it was given
+    rows = [dict(d) for d in documents]
+    for item in rows:
+        item['_id'] = str(item['_id'])
+        if 'timestamp' in item:
+            item['timestamp'] = item['timestamp'].isoformat()
+    return json.dumps(rows).encode('utf-8')
+
+def new_path(documents):
+    rows = [dict(d) for d in documents]
+    return serialization.dumps_bytes(rows)
+
+def bench(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number=repeat, repeat=3)) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark response serialization')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"Serialization backend: {serialization.BACKEND}")
+    print("=" * 60)
+    print(f"{'rows':>6} {'old (us)':>12} {'new (us)':>12} {'speedup':>10}")
+    for size in args.sizes:
+        documents = make_documents(size)
+        assert json.loads(old_path(documents)) == json.loads(new_path(documents))
+        old = bench(old_path, documents, args.repeat) * 1e6
+        new = bench(new_path, documents, args.repeat) * 1e6
+        print(f"{size:>6} {old:>12.1f} {new:>12.1f} {old / new:>9.1f}x")
+
+    payload = json.dumps({
+        'user_id': '6912bf7e2662f139fcd0db53', 'role': 'mother',
+        'temperature': 25.5, 'light': 450, 'moisture': 65, 'ir': 1
+    }).encode('utf-8')
+    repeat = args.repeat * 50
+    old = bench(lambda p: json.loads(p.decode('utf-8')), payload, repeat) * 1e6
+    new = bench(serialization.loads, payload, repeat) * 1e6
+    print("=" * 60)
+    print(f"MQTT payload decode: old {old:.2f} us, new {new:.2f} us ({old / new:.1f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark Server
+The app as bench_http.py serves it: background services off and
+OpenAIService replaced by a stub, so /api/recommendations measures only
+this app. Configuration comes from the environment bench_http.py sets.
+
+Usage (bench_http.py starts one of these itself):
+    gunicorn -w 4 -b 127.0.0.1:8000 --chdir benchmarks "bench_server:create_bench_app()"
+    python benchmarks/bench_server.py --port 8000      # werkzeug, threaded
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubOpenAIService:
+    """Returns a fixed response after an optional simulated latency"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def get_recommendations(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return {
+            'recommendations': [{'name': 'Benchmark Shampoo', 'type': 'shampoo', 'reason': 'stub', 'key_ingredients': []}],
+            'beneficial_ingredients': [],
+            'tips': [],
+            'reasoning': 'stub'
+        }
+
+    def chat(self, message, sensor_data=None, user_id=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return 'stub'
+
+    def clear_conversation(self, user_id):
+        pass
+
+    def metrics(self):
+        return {'configured': False, 'stub': True}
+
+def create_bench_app():
+    from app import create_app
+    app = create_app()
+    app.extensions['smartcomb'].override(
+        'openai_service', StubOpenAIService(float(os.environ.get('BENCH_LLM_LATENCY') or 0))
+    )
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app for bench_http.py with werkzeug')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    from werkzeug.serving import run_simple
+    run_simple(args.host, args.port, create_bench_app(), threaded=True)
+
+if __name__ == '__main__':
+    main()
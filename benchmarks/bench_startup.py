@@ -0,0 +1,81 @@
+"""
+Cold Start Benchmark
+Measures, in fresh interpreter processes, how long it takes to import
+app.py and build the app with create_app(), and to serve a first request
+that needs no services (the login page). Also checks that none of the
+heavy client libraries were imported along the way.
+
+Exits non-zero if the median cold start exceeds the target, so it can
+guard against regressions.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 10 --target-ms 300
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be imported until a service that needs them is used
+DEFERRED_MODULES = ['openai', 'paho', 'numpy', 'pymongo', 'flask_pymongo', 'zstandard']
+
+PROBE = '''
+import sys, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get('/login')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+print((created - started) * 1000, (served - started) * 1000, ','.join(loaded))
+'''
+
+def run_once(deferred):
+    env = dict(os.environ, START_BACKGROUND_SERVICES='false', DIAGNOSTICS_ENABLED='false')
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(deferred=deferred)],
+        cwd=ROOT, env=env, text=True
+    )
+    fields = output.strip().splitlines()[-1].split(' ')
+    loaded = fields[2].split(',') if len(fields) > 2 and fields[2] else []
+    return float(fields[0]), float(fields[1]), loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of the Flask app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target-ms', type=float, default=300.0,
+                        help='Fail if the median import + create_app() time exceeds this')
+    args = parser.parse_args()
+
+    create_times, request_times = [], []
+    loaded = set()
+    for _ in range(args.runs):
+        create_ms, request_ms, modules = run_once(DEFERRED_MODULES)
+        create_times.append(create_ms)
+        request_times.append(request_ms)
+        loaded.update(modules)
+
+    print(f"{'':>28} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for label, values in (('import + create_app()', create_times), ('first request (/login)', request_times)):
+        print(f"{label:>28} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}")
+
+    failed = False
+    if loaded:
+        print(f"\nFAIL: deferred modules imported at startup: {', '.join(sorted(loaded))}")
+        failed = True
+    median = statistics.median(create_times)
+    if median > args.target_ms:
+        print(f"\nFAIL: median cold start {median:.1f} ms exceeds target {args.target_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print(f"\nOK: median cold start {median:.1f} ms (target {args.target_ms:.0f} ms), no deferred modules imported")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,72 @@ class Config:
     # Flask-PyMongo looks for MONGO_URI
     MONGO_URI = os.environ.get('MONGODB_URI') or 'mongodb://localhost:27017/smartcomb'
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY') or ''
+    # Point at a local fake server to test latency/error handling
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+    OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT') or 15)
+    OPENAI_MAX_ATTEMPTS = int(os.environ.get('OPENAI_MAX_ATTEMPTS') or 3)
+    OPENAI_RETRY_BUDGET_RATIO = float(os.environ.get('OPENAI_RETRY_BUDGET_RATIO') or 0.2)
+    OPENAI_BREAKER_FAILURES = int(os.environ.get('OPENAI_BREAKER_FAILURES') or 5)
+    OPENAI_BREAKER_RESET = float(os.environ.get('OPENAI_BREAKER_RESET') or 30)
+    OPENAI_PROMPT_TOKEN_BUDGET = int(os.environ.get('OPENAI_PROMPT_TOKEN_BUDGET') or 3000)
+    # Per-user chatbot memory: recent turns kept verbatim, older ones summarized
+    CHAT_MEMORY_TURNS = int(os.environ.get('CHAT_MEMORY_TURNS') or 6)
+    CHAT_SUMMARY_TOKENS = int(os.environ.get('CHAT_SUMMARY_TOKENS') or 300)
+    CHAT_MEMORY_MAX_USERS = int(os.environ.get('CHAT_MEMORY_MAX_USERS') or 1000)
+    # Conversations are stored in MongoDB and removed after this many idle days (0 = never)
+    CHAT_MEMORY_RETENTION_DAYS = int(os.environ.get('CHAT_MEMORY_RETENTION_DAYS') or 30)
+    # Retention: readings older than N - ARCHIVE_LEAD_DAYS days are archived to
+    # ARCHIVE_DIR, then expire from MongoDB ARCHIVE_LEAD_DAYS later (0 = keep forever).
+    # Unarchived readings never expire, even with ARCHIVE_INTERVAL = 0
+    SENSOR_DATA_RETENTION_DAYS = int(os.environ.get('SENSOR_DATA_RETENTION_DAYS') or 90)
+    RECOMMENDATIONS_RETENTION_DAYS = int(os.environ.get('RECOMMENDATIONS_RETENTION_DAYS') or 180)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or 'archive'
+    ARCHIVE_LEAD_DAYS = int(os.environ.get('ARCHIVE_LEAD_DAYS') or 7)
+    ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL') or 3600)  # seconds, 0 = disabled
+    # /api/sensor-data?points=N: largest N allowed, and most readings read to downsample
+    CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS') or 1000)
+    CHART_MAX_SOURCE_READINGS = int(os.environ.get('CHART_MAX_SOURCE_READINGS') or 200000)
+    # Run the MQTT subscriber and storage threads in the web process (from the
+    # first request); only for single-process deployments, see `python app.py worker`
+    START_BACKGROUND_SERVICES = (os.environ.get('START_BACKGROUND_SERVICES') or 'false').lower() == 'true'
     MQTT_BROKER = os.environ.get('MQTT_BROKER') or 'broker.hivemq.com'
     MQTT_PORT = int(os.environ.get('MQTT_PORT') or 1883)
+    # Per-device topics live under smartcomb/{user_id}/{device_id}/...
+    MQTT_TOPIC_ROOT = os.environ.get('MQTT_TOPIC_ROOT') or 'smartcomb'
+    # Also accept the old shared topics (smartcomb/sensors, smartcomb/role, ...)
+    MQTT_LEGACY_TOPICS = (os.environ.get('MQTT_LEGACY_TOPICS') or 'false').lower() == 'true'
     MQTT_TOPIC = os.environ.get('MQTT_TOPIC') or 'smartcomb/sensors'
-
+    # Accept uplink only from devices registered via the dashboard; 'true' registers
+    # an unknown device to the (existing) user in its topic on first publish instead
+    MQTT_AUTO_REGISTER_DEVICES = (os.environ.get('MQTT_AUTO_REGISTER_DEVICES') or 'false').lower() == 'true'
+    # How long the ingest worker trusts its cached device owners, in seconds
+    DEVICE_CACHE_SECONDS = float(os.environ.get('DEVICE_CACHE_SECONDS') or 30)
+    # Duplicate suppression for payloads carrying a msg_id
+    MQTT_DEDUP_WINDOW_SIZE = int(os.environ.get('MQTT_DEDUP_WINDOW_SIZE') or 1024)
+    MQTT_DEDUP_WINDOW_SECONDS = float(os.environ.get('MQTT_DEDUP_WINDOW_SECONDS') or 600)
+    # Vibration commands within this window collapse to the latest value
+    VIBRATION_DEBOUNCE_MS = int(os.environ.get('VIBRATION_DEBOUNCE_MS') or 150)
+    # Per-user token buckets as 'N/second|minute|hour' (empty or 0 = unlimited);
+    # RATE_LIMIT_STORAGE_URL (redis://...) shares them between worker processes
+    RATE_LIMIT_ENABLED = (os.environ.get('RATE_LIMIT_ENABLED') or 'true').lower() == 'true'
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL') or None
+    RATE_LIMIT_RECOMMENDATIONS = os.environ.get('RATE_LIMIT_RECOMMENDATIONS') or '10/minute'
+    RATE_LIMIT_CHAT = os.environ.get('RATE_LIMIT_CHAT') or '20/minute'
+    RATE_LIMIT_SET_ROLE = os.environ.get('RATE_LIMIT_SET_ROLE') or '30/minute'
+    RATE_LIMIT_VIBRATION = os.environ.get('RATE_LIMIT_VIBRATION') or '20/second'
+    # OpenAI calls in flight; extra requests get 429 (0 = unlimited). Shared by
+    # all workers through RATE_LIMIT_STORAGE_URL, otherwise per process
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY') or 8)
+    # A shared slot held longer than this (e.g. by a crashed worker) is freed;
+    # keep it well above OPENAI_TIMEOUT
+    LLM_LEASE_SECONDS = float(os.environ.get('LLM_LEASE_SECONDS') or 60)
+    # Opt-in profiling/memory diagnostics; endpoints require X-Diagnostics-Token
+    DIAGNOSTICS_ENABLED = (os.environ.get('DIAGNOSTICS_ENABLED') or 'false').lower() == 'true'
+    DIAGNOSTICS_TOKEN = os.environ.get('DIAGNOSTICS_TOKEN') or ''
+    DIAGNOSTICS_PROFILE_SAMPLE_RATE = float(os.environ.get('DIAGNOSTICS_PROFILE_SAMPLE_RATE') or 0)
+    DIAGNOSTICS_SAMPLE_INTERVAL_MS = float(os.environ.get('DIAGNOSTICS_SAMPLE_INTERVAL_MS') or 5)
+    DIAGNOSTICS_TRACEMALLOC_INTERVAL = int(os.environ.get('DIAGNOSTICS_TRACEMALLOC_INTERVAL') or 0)  # seconds, 0 = off
+    DIAGNOSTICS_OUTPUT_DIR = os.environ.get('DIAGNOSTICS_OUTPUT_DIR') or 'diagnostics'
+    DIAGNOSTICS_MAX_PROFILES = int(os.environ.get('DIAGNOSTICS_MAX_PROFILES') or 200)  # oldest request profiles are deleted
+    # Loopback port where `python app.py worker` serves the diagnostics endpoints
+    DIAGNOSTICS_WORKER_PORT = int(os.environ.get('DIAGNOSTICS_WORKER_PORT') or 4001)
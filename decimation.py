@@ -0,0 +1,79 @@
+"""
+Largest-Triangle-Three-Buckets (LTTB) downsampling for chart data.
+
+LTTB keeps the first and last points and, from each bucket in between,
+the point forming the largest triangle with the previously kept point and
+the average of the next bucket. Peaks and troughs survive, so the chart
+keeps its shape at a fixed number of points however long the range is.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+SERIES = ('temperature', 'light', 'moisture')
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points LTTB keeps from (x, y), in ascending x order"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket k covers [edges[k], edges[k + 1]) of the interior points 1..n-2
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Averages of every bucket up front, so the loop only does the area scan
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    buckets = threshold - 2
+    for k in range(buckets):
+        start, end = edges[k], edges[k + 1]
+        if k + 1 < buckets:
+            next_x, next_y = avg_x[k + 1], avg_y[k + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[k + 1] = a
+    return selected
+
+def decimate_readings(readings, points, series=SERIES):
+    """Downsample sensor readings to at most `points` rows
+
+    LTTB runs separately for each series with an equal share of the points
+    and the kept rows are merged, so every series keeps its own peaks and
+    the payload never exceeds `points` rows. Readings without a datetime
+    timestamp are dropped. Input and output are newest first, as returned
+    by the sensor-data API.
+    """
+    ordered = [r for r in reversed(readings) if isinstance(r.get('timestamp'), datetime)]
+    n = len(ordered)
+    if n <= points:
+        return ordered[::-1]
+
+    x = np.fromiter((r['timestamp'].timestamp() for r in ordered), dtype=np.float64, count=n)
+    share = max(3, points // len(series))
+    keep = np.zeros(n, dtype=bool)
+    for name in series:
+        y = np.fromiter((float(r.get(name) or 0) for r in ordered), dtype=np.float64, count=n)
+        keep[lttb_indices(x, y, share)] = True
+
+    kept = np.flatnonzero(keep)
+    if len(kept) > points:
+        # Only when points < 3 per series: thin evenly, keeping both ends
+        kept = kept[np.linspace(0, len(kept) - 1, points).round().astype(np.int64)]
+    return [ordered[i] for i in kept[::-1]]
@@ -0,0 +1,99 @@
+"""
+Duplicate-message suppression for MQTT ingestion.
+
+Devices may include a `msg_id` in their payloads. Redeliveries (QoS 1,
+batch retries) of a recently stored id are dropped in O(1) from a bounded
+in-memory window, without a MongoDB read. Ids enter the window only once
+the reading is stored, so a message that was gated out or failed to
+insert is still accepted when it is redelivered. A partial unique index on
+(user_id, device_id, msg_id) backs this up for anything that falls out
+of the window, e.g. after a restart.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ASCENDING
+
+def ensure_dedup_index(db):
+    """Unique index that rejects a msg_id stored twice for the same device"""
+    db.sensor_data.create_index(
+        [('user_id', ASCENDING), ('device_id', ASCENDING), ('msg_id', ASCENDING)],
+        unique=True,
+        partialFilterExpression={'msg_id': {'$exists': True}},
+        name='msg_id_unique'
+    )
+
+class DedupWindow:
+    """Recently seen message ids per device, bounded by count and age
+
+    Each device keeps at most `max_per_device` ids for at most `max_age`
+    seconds; at most `max_devices` devices are tracked, least recently
+    active evicted first.
+    """
+
+    def __init__(self, max_per_device=1024, max_age=600.0, max_devices=10000):
+        self.max_per_device = max_per_device
+        self.max_age = max_age
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+
+    def _ids(self, device_key, now, create):
+        """The device's id window with expired ids dropped (caller holds the lock)"""
+        ids = self._devices.get(device_key)
+        if ids is None:
+            if not create:
+                return None
+            ids = OrderedDict()
+            self._devices[device_key] = ids
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_key)
+
+        # Expire from the oldest end; ids are kept in arrival order
+        while ids:
+            oldest_id, seen_at = next(iter(ids.items()))
+            if now - seen_at <= self.max_age:
+                break
+            del ids[oldest_id]
+        return ids
+
+    def contains(self, device_key, msg_id, now=None):
+        """True if msg_id is in the device's window; does not record it"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.checked += 1
+            ids = self._ids(device_key, now, create=False)
+            if ids is not None and msg_id in ids:
+                self.duplicates += 1
+                return True
+            return False
+
+    def add(self, device_key, msg_id, now=None):
+        """Record msg_id for the device, e.g. once it has been stored"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ids = self._ids(device_key, now, create=True)
+            ids[msg_id] = now
+            if len(ids) > self.max_per_device:
+                ids.popitem(last=False)
+
+    def seen(self, device_key, msg_id, now=None):
+        """Check and record in one step; True if msg_id was already in the window"""
+        if self.contains(device_key, msg_id, now):
+            return True
+        self.add(device_key, msg_id, now)
+        return False
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'duplicates': self.duplicates,
+                'devices': len(self._devices)
+            }
@@ -0,0 +1,106 @@
+"""
+Device-to-user registry for per-device MQTT topics.
+
+Devices are stored in the `devices` collection. Ownership lookups are
+served from an in-process cache, so the MQTT ingest path does not read
+MongoDB for every message. Registrations and removals usually happen in a
+web process, not in the worker that ingests, so cached owners (and cached
+"not registered" answers) expire after `cache_seconds`, and a failed claim
+re-reads MongoDB at most once per `refresh_interval`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+class DeviceRegistry:
+    def __init__(self, mongo, cache_seconds=30, refresh_interval=1.0, max_cached=100000):
+        self.mongo = mongo
+        self.cache_seconds = cache_seconds
+        self.refresh_interval = refresh_interval
+        self.max_cached = max_cached
+        self._owners = OrderedDict()  # device_id -> (user_id or None, loaded at)
+        self._lock = threading.Lock()
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.mongo.db.devices.create_index('device_id', unique=True)
+            self._indexed = True
+
+    def _cache(self, device_id, user_id):
+        with self._lock:
+            self._owners.pop(device_id, None)
+            self._owners[device_id] = (user_id, time.monotonic())
+            if len(self._owners) > self.max_cached:
+                self._owners.popitem(last=False)
+
+    def _load(self, device_id):
+        device = self.mongo.db.devices.find_one({'device_id': device_id}, {'user_id': 1})
+        user_id = device['user_id'] if device else None
+        self._cache(device_id, user_id)
+        return user_id
+
+    def _cache_age(self, device_id):
+        with self._lock:
+            entry = self._owners.get(device_id)
+        return time.monotonic() - entry[1] if entry else None
+
+    def owner(self, device_id):
+        """user_id that owns the device, or None if it is not registered"""
+        with self._lock:
+            entry = self._owners.get(device_id)
+        if entry and time.monotonic() - entry[1] < self.cache_seconds:
+            return entry[0]
+        return self._load(device_id)
+
+    def register(self, user_id, device_id, name=None):
+        """Register a device to a user; returns False if another user owns it"""
+        self._ensure_index()
+        current = self._load(device_id)
+        if current and current != user_id:
+            return False
+        try:
+            self.mongo.db.devices.update_one(
+                {'device_id': device_id, 'user_id': user_id},
+                {
+                    '$set': {'name': name or device_id},
+                    '$setOnInsert': {'created_at': datetime.utcnow()}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        self._cache(device_id, user_id)
+        return True
+
+    def claim(self, user_id, device_id, auto_register=False):
+        """Ownership check for incoming messages
+
+        Messages are accepted only from devices registered to the user in
+        the topic. With auto_register, an unknown device is registered to
+        that user on its first publish, provided the user exists; anyone on
+        the broker could otherwise claim another household's comb first.
+        """
+        current = self.owner(device_id)
+        if current != user_id and self._cache_age(device_id) >= self.refresh_interval:
+            # Possibly registered, removed or moved by another process since it was cached
+            current = self._load(device_id)
+        if current is None:
+            if not auto_register or not self.mongo.db.users.find_one({'_id': ObjectId(user_id)}, {'_id': 1}):
+                return False
+            return self.register(user_id, device_id)
+        return current == user_id
+
+    def remove(self, user_id, device_id):
+        result = self.mongo.db.devices.delete_one({'device_id': device_id, 'user_id': user_id})
+        if result.deleted_count:
+            self._cache(device_id, None)
+        return result.deleted_count > 0
+
+    def devices_for_user(self, user_id):
+        return list(self.mongo.db.devices.find({'user_id': user_id}, {'_id': 0}).sort('created_at', 1))
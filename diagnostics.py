@@ -0,0 +1,286 @@
+"""
+Opt-in runtime diagnostics for the web + MQTT process.
+
+When DIAGNOSTICS_ENABLED is set (and DIAGNOSTICS_TOKEN is configured),
+this adds:
+- per-request sampling profiles, triggered by the X-Diagnostics-Profile
+  header or a sample rate, written as collapsed stacks for flamegraphs
+- on-demand sampling of any named thread (e.g. the MQTT client)
+- periodic tracemalloc snapshots with top-allocation diffs
+- thread stack dumps
+
+All endpoints require the X-Diagnostics-Token header. When diagnostics are
+disabled nothing is registered: no hooks, no routes, no sampler thread.
+
+The background worker serves no HTTP, so it exposes the same endpoints,
+and /api/metrics, on a loopback-only port (serve_worker_diagnostics). Independently of these
+settings, the worker prints every thread's stack on SIGUSR1.
+"""
+
+import faulthandler
+import hmac
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from datetime import datetime
+
+from flask import g, jsonify, request
+
+TOKEN_HEADER = 'X-Diagnostics-Token'
+PROFILE_HEADER = 'X-Diagnostics-Profile'
+
+def token_authorized(token):
+    """True if the request carries `token` in the X-Diagnostics-Token header"""
+    if not token:
+        return False
+    supplied = request.headers.get(TOKEN_HEADER, '')
+    return hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+def _collapse(frame):
+    """Collapsed stack for a frame, root first: 'module:func;module:func'"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    parts.reverse()
+    return ';'.join(parts)
+
+def format_collapsed(counts):
+    """Brendan Gregg's collapsed format, ready for flamegraph.pl / speedscope"""
+    return '\n'.join(f"{stack} {count}" for stack, count in counts.most_common()) + '\n'
+
+class SamplingProfiler:
+    """One background thread sampling the stacks of registered threads
+
+    The thread sleeps on a condition while nothing is being profiled.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._targets = {}  # thread id -> Counter of collapsed stacks
+        self._cond = threading.Condition()
+        self._thread = None
+        self.samples_taken = 0
+
+    def start(self, thread_id):
+        with self._cond:
+            self._targets[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='diagnostics-sampler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self, thread_id):
+        with self._cond:
+            return self._targets.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._targets:
+                    self._cond.wait()
+            time.sleep(self.interval)
+            with self._cond:
+                frames = sys._current_frames()
+                for thread_id, counts in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[_collapse(frame)] += 1
+                        self.samples_taken += 1
+
+class MemoryTracker:
+    """Periodic tracemalloc snapshots, keeping the diff against the previous one"""
+
+    def __init__(self, interval, top=20, frames=10):
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+        self.last_diff = []
+        self.last_snapshot_at = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        if self.interval > 0:
+            threading.Thread(target=self._run, name='diagnostics-tracemalloc', daemon=True).start()
+
+    def snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        with self._lock:
+            if self._previous is not None:
+                stats = snapshot.compare_to(self._previous, 'lineno')
+            else:
+                stats = snapshot.statistics('lineno')
+            self.last_diff = [{
+                'location': str(stat.traceback),
+                'size_kb': round(stat.size / 1024, 1),
+                'size_diff_kb': round(getattr(stat, 'size_diff', stat.size) / 1024, 1),
+                'count': stat.count,
+                'count_diff': getattr(stat, 'count_diff', stat.count)
+            } for stat in stats[:self.top]]
+            self._previous = snapshot
+            self.last_snapshot_at = datetime.utcnow()
+        return self.last_diff
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                diff = self.snapshot()
+                if diff:
+                    top = diff[0]
+                    print(f"[DIAGNOSTICS] tracemalloc top growth: {top['location']} {top['size_diff_kb']:+} KB")
+            except Exception as e:
+                print(f"[DIAGNOSTICS] tracemalloc snapshot failed: {e}")
+
+    def report(self):
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            return {
+                'traced_current_kb': round(current / 1024, 1),
+                'traced_peak_kb': round(peak / 1024, 1),
+                'last_snapshot_at': self.last_snapshot_at,
+                'top_diff': self.last_diff
+            }
+
+def thread_dump():
+    """Stack of every live thread, as text"""
+    frames = sys._current_frames()
+    lines = []
+    for thread in threading.enumerate():
+        lines.append(f"Thread {thread.name} (id={thread.ident}, daemon={thread.daemon}):")
+        frame = frames.get(thread.ident)
+        if frame is not None:
+            lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+        lines.append('')
+    return '\n'.join(lines)
+
+def _prune_profiles(output_dir, keep):
+    """Delete the oldest request profiles beyond the newest `keep`"""
+    names = sorted(n for n in os.listdir(output_dir) if n.startswith('request-') and n.endswith('.collapsed'))
+    for name in names[:max(0, len(names) - keep)]:
+        try:
+            os.remove(os.path.join(output_dir, name))
+        except OSError:
+            pass
+
+def init_diagnostics(app):
+    """Register diagnostics hooks and routes if enabled in the app config"""
+    if not app.config.get('DIAGNOSTICS_ENABLED'):
+        return None
+    token = app.config.get('DIAGNOSTICS_TOKEN')
+    if not token:
+        print("[DIAGNOSTICS] DIAGNOSTICS_ENABLED is set but DIAGNOSTICS_TOKEN is empty; diagnostics stay disabled")
+        return None
+
+    output_dir = app.config['DIAGNOSTICS_OUTPUT_DIR']
+    sample_rate = app.config['DIAGNOSTICS_PROFILE_SAMPLE_RATE']
+    max_profiles = app.config['DIAGNOSTICS_MAX_PROFILES']
+    profiler = SamplingProfiler(app.config['DIAGNOSTICS_SAMPLE_INTERVAL_MS'] / 1000.0)
+    memory = None
+    if app.config['DIAGNOSTICS_TRACEMALLOC_INTERVAL'] > 0:
+        memory = MemoryTracker(app.config['DIAGNOSTICS_TRACEMALLOC_INTERVAL'])
+        memory.start()
+    os.makedirs(output_dir, exist_ok=True)
+
+    def authorized():
+        return token_authorized(token)
+
+    @app.before_request
+    def start_request_profile():
+        requested = request.headers.get(PROFILE_HEADER) == '1' and authorized()
+        if requested or (sample_rate > 0 and random.random() < sample_rate):
+            g.diagnostics_profile = time.perf_counter()
+            profiler.start(threading.get_ident())
+
+    @app.teardown_request
+    def finish_request_profile(exc=None):
+        started = g.pop('diagnostics_profile', None)
+        if started is None:
+            return
+        counts = profiler.stop(threading.get_ident())
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        name = f"request-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{request.endpoint or 'unknown'}.collapsed"
+        with open(os.path.join(output_dir, name), 'w') as f:
+            f.write(format_collapsed(counts))
+        _prune_profiles(output_dir, max_profiles)
+        print(f"[DIAGNOSTICS] Profiled {request.method} {request.path} ({elapsed_ms:.1f} ms, {sum(counts.values())} samples) -> {name}")
+
+    def require_token(view):
+        def wrapped(*args, **kwargs):
+            if not authorized():
+                return jsonify({'error': 'Unauthorized'}), 401
+            return view(*args, **kwargs)
+        wrapped.__name__ = view.__name__
+        return wrapped
+
+    @require_token
+    def diagnostics_threads():
+        return app.response_class(thread_dump(), mimetype='text/plain')
+
+    @require_token
+    def diagnostics_profile_thread():
+        """Sample a named thread (e.g. mqtt-client) for a few seconds"""
+        name = request.args.get('name', 'mqtt-client')
+        try:
+            seconds = float(request.args.get('seconds', 5))
+        except ValueError:
+            seconds = None
+        if seconds is None or not 0 < seconds <= 60:
+            return jsonify({'error': 'seconds must be a number between 0 and 60'}), 400
+        thread = next((t for t in threading.enumerate() if t.name == name), None)
+        if thread is None:
+            return jsonify({'error': f'No thread named {name}'}), 404
+        profiler.start(thread.ident)
+        time.sleep(seconds)
+        counts = profiler.stop(thread.ident)
+        return app.response_class(format_collapsed(counts), mimetype='text/plain')
+
+    @require_token
+    def diagnostics_memory():
+        if memory is None:
+            return jsonify({'error': 'tracemalloc is not enabled (set DIAGNOSTICS_TRACEMALLOC_INTERVAL)'}), 404
+        if request.args.get('snapshot') == '1':
+            memory.snapshot()
+        return jsonify(memory.report())
+
+    app.add_url_rule('/api/diagnostics/threads', view_func=diagnostics_threads)
+    app.add_url_rule('/api/diagnostics/profile-thread', view_func=diagnostics_profile_thread)
+    app.add_url_rule('/api/diagnostics/memory', view_func=diagnostics_memory)
+
+    app.extensions['diagnostics'] = profiler
+    print(f"[DIAGNOSTICS] Enabled (request sample rate {sample_rate}, output in {output_dir})")
+    return profiler
+
+def serve_worker_diagnostics(app, port):
+    """Serve only the diagnostics and metrics endpoints on 127.0.0.1:port, from a daemon thread"""
+    from werkzeug.serving import make_server
+
+    def diagnostics_only(environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not (path.startswith('/api/diagnostics/') or path == '/api/metrics'):
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return [b'Not found\n']
+        return app(environ, start_response)
+
+    server = make_server('127.0.0.1', port, diagnostics_only, threaded=True)
+    threading.Thread(target=server.serve_forever, name='diagnostics-http', daemon=True).start()
+    print(f"[DIAGNOSTICS] Worker diagnostics on http://127.0.0.1:{port}/api/diagnostics/")
+    return server
+
+def install_stack_dump_signal():
+    """Print every thread's stack to stderr on SIGUSR1 (kill -USR1 <pid>)"""
+    if hasattr(signal, 'SIGUSR1'):
+        faulthandler.register(signal.SIGUSR1, all_threads=True)
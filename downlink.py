@@ -0,0 +1,111 @@
+"""
+Debounced, last-value-wins downlink for device commands.
+
+Web workers don't publish commands themselves. DownlinkQueue records the
+latest payload per topic in the `downlink_commands` collection, and a
+single DownlinkPublisher in the background worker publishes pending
+topics once per debounce window, retained, so a comb that reconnects
+immediately receives the current state.
+
+Commands submitted within one window replace each other. Because only
+one process publishes, an older value can never overwrite a newer one on
+the broker. A publish that fails stays pending and is retried, unless a
+newer command for the topic has replaced it by then.
+"""
+
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+class DownlinkQueue:
+    """Records commands for the publisher; used by the web processes"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.received = 0
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index([('pending', ASCENDING)])
+            self._indexed = True
+
+    def submit(self, topic, payload):
+        """Queue a command, replacing any unpublished one for the topic"""
+        self._ensure_index()
+        self.collection.update_one(
+            {'_id': topic},
+            {
+                '$set': {'payload': payload, 'pending': True, 'submitted_at': datetime.utcnow()},
+                '$inc': {'seq': 1}
+            },
+            upsert=True
+        )
+        self.received += 1
+
+    def metrics(self):
+        return {
+            'received': self.received,
+            'pending': self.collection.count_documents({'pending': True}),
+            'failing': self.collection.count_documents({'pending': True, 'last_error': {'$ne': None}})
+        }
+
+class DownlinkPublisher:
+    """Publishes pending commands; run exactly one, in the background worker"""
+
+    def __init__(self, collection, publish, window=0.15, max_backoff=30.0):
+        """publish(messages) sends a list of {'topic', 'payload', 'retain'} dicts"""
+        self.collection = collection
+        self.publish = publish
+        self.window = window
+        self.max_backoff = max_backoff
+        self.published = 0
+        self.publish_errors = 0
+        self.last_error = None
+
+    def publish_pending(self):
+        """Publish every pending command once; returns False if the publish failed"""
+        commands = list(self.collection.find({'pending': True}, {'payload': 1, 'seq': 1}))
+        if not commands:
+            return True
+        messages = [{'topic': c['_id'], 'payload': c['payload'], 'retain': True} for c in commands]
+        try:
+            self.publish(messages)
+        except Exception as e:
+            self.publish_errors += 1
+            self.last_error = str(e)
+            print(f"[DOWNLINK] Error publishing commands: {e}")
+            for command in commands:
+                self.collection.update_one({'_id': command['_id']}, {'$set': {'last_error': str(e)}})
+            return False
+        published_at = datetime.utcnow()
+        for command in commands:
+            # A command submitted while publishing keeps the topic pending
+            self.collection.update_one(
+                {'_id': command['_id'], 'seq': command['seq']},
+                {'$set': {'pending': False, 'published_at': published_at, 'last_error': None}}
+            )
+        self.published += len(messages)
+        print(f"[DOWNLINK] Published {len(messages)} command(s): {[m['topic'] for m in messages]}")
+        return True
+
+    def run_forever(self):
+        """Poll once per debounce window, backing off while publishing fails"""
+        delay = self.window
+        while True:
+            try:
+                ok = self.publish_pending()
+            except Exception as e:
+                print(f"[DOWNLINK] Error reading pending commands: {e}")
+                ok = False
+            delay = self.window if ok else min(self.max_backoff, max(delay, self.window) * 2)
+            time.sleep(delay)
+
+    def metrics(self):
+        return {
+            'published': self.published,
+            'publish_errors': self.publish_errors,
+            'last_error': self.last_error,
+            'window_ms': int(self.window * 1000)
+        }
@@ -26,14 +26,19 @@
  // MQTT Configuration
  const char* mqtt_broker = "broker.hivemq.com";
  const int mqtt_port = 1883;
- const char* mqtt_topic_sensors = "smartcomb/sensors";
- const char* mqtt_topic_ir = "smartcomb/sensors/ir";
- const char* mqtt_topic_role = "smartcomb/role";  // Subscribe to role changes
- const char* mqtt_topic_vibration = "smartcomb/vibration";  // Subscribe to vibration motor control
+ const char* mqtt_topic_root = "smartcomb";
  
  // User ID - UPDATE THIS with your user_id from the dashboard
  const char* user_id = "6912bf7e2662f139fcd0db53";
  
+ // Per-device topics: smartcomb/{user_id}/{device_id}/...
+ // device_id is derived from the WiFi MAC address in setup()
+ String device_id;
+ String mqtt_topic_sensors;
+ String mqtt_topic_ir;
+ String mqtt_topic_role;       // Subscribe to role changes
+ String mqtt_topic_vibration;  // Subscribe to vibration motor control
+ 
  // Sensor Pins - UPDATE THESE based on your wiring
  #define ONE_WIRE_BUS 4          // DS18B20 data pin
  #define LIGHT_SENSOR_PIN 34     // Analog light sensor (ADC1)
@@ -54,6 +59,9 @@
  bool isCombing = false;
  bool vibrationMotorOn = false;  // Vibration motor state
  unsigned long lastSensorRead = 0;
+ // Message ids let the server drop redelivered readings: "<boot id>-<counter>"
+ String bootId;
+ unsigned long msgCounter = 0;
  const unsigned long sensorInterval = 2000;  // Read sensors every 2 seconds
  
  void setup() {
@@ -77,6 +85,19 @@
    // Connect to WiFi
    setup_wifi();
    
+   // Build this device's topic namespace
+   device_id = WiFi.macAddress();
+   device_id.replace(":", "");
+   device_id.toLowerCase();
+   String topic_prefix = String(mqtt_topic_root) + "/" + user_id + "/" + device_id;
+   mqtt_topic_sensors = topic_prefix + "/sensors";
+   mqtt_topic_ir = topic_prefix + "/sensors/ir";
+   mqtt_topic_role = topic_prefix + "/role";
+   mqtt_topic_vibration = topic_prefix + "/vibration";
+   Serial.print("Device ID: ");
+   Serial.println(device_id);
+   bootId = String((uint32_t)esp_random(), HEX);
+   
    // Setup MQTT
    client.setServer(mqtt_broker, mqtt_port);
    client.setCallback(mqtt_callback);
@@ -133,14 +154,14 @@
        Serial.println(" connected!");
        
        // Subscribe to role topic
-       bool subResult = client.subscribe(mqtt_topic_role);
+       bool subResult = client.subscribe(mqtt_topic_role.c_str());
        Serial.print("Subscribed to role topic: ");
        Serial.println(mqtt_topic_role);
        Serial.print("Subscription result: ");
        Serial.println(subResult ? "SUCCESS" : "FAILED");
        
        // Subscribe to vibration motor control topic
-       bool vibSubResult = client.subscribe(mqtt_topic_vibration);
+       bool vibSubResult = client.subscribe(mqtt_topic_vibration.c_str());
        Serial.print("Subscribed to vibration topic: ");
        Serial.println(mqtt_topic_vibration);
        Serial.print("Subscription result: ");
@@ -171,7 +192,7 @@
    }
    
    // Handle role change from website
-   if (topicStr == String(mqtt_topic_role)) {
+   if (topicStr == mqtt_topic_role) {
      Serial.print("Received role: '");
      Serial.print(payloadStr);
      Serial.println("'");
@@ -189,7 +210,7 @@
      }
    }
    // Handle vibration motor control
-   else if (topicStr == String(mqtt_topic_vibration)) {
+   else if (topicStr == mqtt_topic_vibration) {
      Serial.print("Received vibration command: '");
      Serial.print(payloadStr);
      Serial.println("'");
@@ -234,7 +255,7 @@
    
    // Publish IR sensor status
    String irPayload = "{\"value\":" + String(isCombing ? 1 : 0) + "}";
-   client.publish(mqtt_topic_ir, irPayload.c_str());
+   client.publish(mqtt_topic_ir.c_str(), irPayload.c_str());
    
    // Only read and publish other sensors when combing is detected
    if (isCombing) {
@@ -266,6 +287,7 @@
     // Create JSON payload
     String payload = "{";
     payload += "\"user_id\":\"" + String(user_id) + "\",";
+    payload += "\"msg_id\":\"" + bootId + "-" + String(msgCounter++) + "\",";
     payload += "\"role\":\"" + currentRole + "\",";
     payload += "\"temperature\":" + String(temperature, 1) + ",";
     payload += "\"light\":" + String(lightPercent, 1) + ",";  // Light percentage (0-100)
@@ -274,7 +296,7 @@
     payload += "}";
      
      // Publish sensor data
-     client.publish(mqtt_topic_sensors, payload.c_str());
+     client.publish(mqtt_topic_sensors.c_str(), payload.c_str());
      
      // Serial output for debugging
      Serial.println("=== Sensor Readings ===");
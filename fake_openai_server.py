@@ -0,0 +1,104 @@
+"""
+Fake OpenAI Server
+A local stand-in for the OpenAI chat completions API that injects latency
+and errors, for exercising the timeout/retry/circuit breaker behaviour.
+
+Usage:
+    python fake_openai_server.py --port 8099 --latency 0.5 --jitter 2 --error-rate 0.3
+
+Then point the app at it:
+    OPENAI_BASE_URL=http://localhost:8099/v1 OPENAI_API_KEY=fake python app.py
+"""
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SETTINGS = {
+    'latency': 0.0,
+    'jitter': 0.0,
+    'error_rate': 0.0,
+    'error_status': 503,
+}
+
+def completion_body(content):
+    return {
+        'id': 'chatcmpl-fake',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'gpt-3.5-turbo',
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop'
+        }],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    }
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        time.sleep(SETTINGS['latency'] + random.uniform(0, SETTINGS['jitter']))
+
+        if random.random() < SETTINGS['error_rate']:
+            self._send_json(SETTINGS['error_status'], {
+                'error': {'message': 'Injected failure', 'type': 'server_error'}
+            })
+            return
+
+        content = json.dumps({
+            'recommendations': [{
+                'name': 'Moisturizing Conditioner',
+                'type': 'conditioner',
+                'reason': 'Fake response from local test server',
+                'key_ingredients': ['argan oil']
+            }],
+            'beneficial_ingredients': [],
+            'tips': ['This is a fake response'],
+            'reasoning': 'Fake response'
+        })
+        self._send_json(200, completion_body(content))
+
+    def log_message(self, format, *args):
+        print(f"[FAKE-OPENAI] {self.address_string()} - {format % args}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI server with latency/error injection')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail (0-1)')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP status for injected failures')
+    args = parser.parse_args()
+
+    SETTINGS['latency'] = args.latency
+    SETTINGS['jitter'] = args.jitter
+    SETTINGS['error_rate'] = args.error_rate
+    SETTINGS['error_status'] = args.error_status
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FakeOpenAIHandler)
+    print(f"Fake OpenAI server listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping fake server...")
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,196 @@
-import paho.mqtt.client as mqtt
-import json
+import time
 from datetime import datetime
 from flask import Flask
+from pymongo.errors import DuplicateKeyError
+from serialization import loads
+from dedup import DedupWindow
+import topics
 
 class MQTTClient:
-    def __init__(self, app: Flask, mongo):
+    def __init__(self, app: Flask, mongo, registry):
         self.app = app
         self.mongo = mongo
+        self.registry = registry
         self.client = None
         self.broker = app.config['MQTT_BROKER']
         self.port = app.config['MQTT_PORT']
         self.topic = app.config['MQTT_TOPIC']
-        self.is_combing = False
+        self.topic_root = app.config['MQTT_TOPIC_ROOT']
+        self.legacy_topics = app.config['MQTT_LEGACY_TOPICS']
+        self.auto_register = app.config['MQTT_AUTO_REGISTER_DEVICES']
+        # Combing state per (user_id, device_id), from each device's IR topic
+        self.combing = {}
+        self.rejected = 0
+        self.dedup = DedupWindow(
+            max_per_device=app.config['MQTT_DEDUP_WINDOW_SIZE'],
+            max_age=app.config['MQTT_DEDUP_WINDOW_SECONDS']
+        )
+        self.duplicates_dropped = 0
+        # Per-message logging; turned off for replay/benchmarks
+        self.verbose = True
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print(f"Connected to MQTT Broker: {self.broker}")
-            client.subscribe(self.topic)
-            client.subscribe(f"{self.topic}/ir")  # IR sensor topic
+            for topic in topics.server_subscriptions(self.topic_root):
+                client.subscribe(topic)
+            if self.legacy_topics:
+                client.subscribe(self.topic)
+                client.subscribe(f"{self.topic}/ir")  # IR sensor topic
         else:
             print(f"Failed to connect, return code {rc}")
     
+    def _resolve_source(self, topic, data):
+        """(user_id, device_id, channel) for a message, or None to drop it"""
+        parsed = topics.parse_topic(self.topic_root, topic)
+        if parsed:
+            user_id, device_id, channel = parsed
+            if not self.registry.claim(user_id, device_id, self.auto_register):
+                self.rejected += 1
+                if self.verbose:
+                    print(f"[MQTT] Rejected message from device {device_id}: not registered to user {user_id}")
+                return None
+            return user_id, device_id, channel
+        
+        if self.legacy_topics and (topic == self.topic or topic == f"{self.topic}/ir"):
+            # Legacy shared topic: identity comes from the payload
+            channel = topics.IR if topic.endswith('/ir') else topics.SENSORS
+            user_id = data.get('user_id')
+            if not topics.is_user_id(user_id):
+                self.rejected += 1
+                return None
+            return user_id, None, channel
+        return None
+    
     def on_message(self, client, userdata, msg):
         try:
-            payload = msg.payload.decode('utf-8')
-            data = json.loads(payload)
-            
-            topic = msg.topic
-            
-            # Check IR sensor to determine if combing
-            if topic.endswith('/ir'):
-                self.is_combing = data.get('value', 0) == 1
-                print(f"IR Sensor: Combing = {self.is_combing}")
-                return
-            
-            # Only process other sensors if combing is detected
-            if not self.is_combing:
-                print("Not combing, ignoring sensor data")
-                return
-            
-            # Process sensor data
-            with self.app.app_context():
-                # Get raw values
-                light_raw = data.get('light', 0)
-                moisture_raw = data.get('moisture', 0)
-                
-                # Convert to percentages if needed (handle both raw ADC and percentage values)
-                light_value = self._convert_light_value(light_raw)
-                # For moisture, use the same inverted conversion logic
-                if moisture_raw > 100:
-                    moisture_value = ((4095.0 - moisture_raw) / 4095.0) * 100.0
-                else:
-                    moisture_value = moisture_raw
-                moisture_value = max(0, min(100, moisture_value))
-                
-                sensor_data = {
-                    'user_id': data.get('user_id', 'anonymous'),
-                    'role': data.get('role', 'user'),
-                    'temperature': data.get('temperature', 0),
-                    'light': light_value,  # Store as percentage (0-100)
-                    'moisture': moisture_value,  # Store as percentage (0-100)
-                    'moisture_status': self._determine_moisture_status(moisture_raw),
-                    'ir_sensor': data.get('ir', 0),
-                    'timestamp': datetime.utcnow()
-                }
-                
-                self.mongo.db.sensor_data.insert_one(sensor_data)
-                print(f"[MQTT] Saved sensor data - User: {sensor_data['user_id']}, Role: {sensor_data['role']}, Temp: {sensor_data['temperature']}°C")
-                
+            self.ingest(msg.topic, msg.payload)
         except Exception as e:
             print(f"Error processing MQTT message: {e}")
     
+    def ingest(self, topic, payload, received_at=None, timer=None):
+        """Run one message through the ingest stages: decode, gate, normalize, write
+
+        Returns the outcome ('stored', 'ir', 'not_combing', 'duplicate',
+        'rejected' or 'ignored'). `timer`, if given, is called as
+        timer(stage, seconds) after each stage; the replay harness uses it
+        to profile the path without a broker.
+        """
+        clock = time.perf_counter
+        started = clock() if timer else 0.0
+        
+        # Decode
+        data = loads(payload)
+        if timer:
+            now = clock()
+            timer('decode', now - started)
+            started = now
+        
+        # Gate: who sent it, and whether it gets stored
+        source = self._resolve_source(topic, data)
+        outcome = 'rejected'
+        if source is not None:
+            user_id, device_id, channel = source
+            outcome = self._gate(data, user_id, device_id, channel)
+        if timer:
+            now = clock()
+            timer('gate', now - started)
+            started = now
+        if outcome is not None:
+            return outcome
+        
+        # Normalize: only for readings that will be stored
+        sensor_data = self._normalize(data, user_id, device_id, received_at or datetime.utcnow())
+        if timer:
+            now = clock()
+            timer('normalize', now - started)
+            started = now
+        
+        # Write
+        try:
+            with self.app.app_context():
+                self.mongo.db.sensor_data.insert_one(sensor_data)
+        except DuplicateKeyError:
+            # Already stored, but no longer in the in-memory window
+            self.duplicates_dropped += 1
+            self._remember(data, user_id, device_id)
+            return 'duplicate'
+        finally:
+            if timer:
+                timer('write', clock() - started)
+        self._remember(data, user_id, device_id)
+        if self.verbose:
+            print(f"[MQTT] Saved sensor data - User: {sensor_data['user_id']}, Role: {sensor_data['role']}, Temp: {sensor_data['temperature']}°C")
+        return 'stored'
+    
+    def _gate(self, data, user_id, device_id, channel):
+        """Decide whether a message gets stored; returns None to store it, otherwise the outcome"""
+        # Check IR sensor to determine if combing
+        if channel == topics.IR:
+            self.combing[(user_id, device_id)] = data.get('value', 0) == 1
+            if self.verbose:
+                print(f"IR Sensor: Device = {device_id}, Combing = {self.combing[(user_id, device_id)]}")
+            return 'ir'
+        
+        if channel != topics.SENSORS:
+            return 'ignored'
+        
+        # Drop redeliveries of a message id stored recently from this device
+        msg_id = data.get('msg_id')
+        if msg_id is not None and self.dedup.contains((user_id, device_id), msg_id):
+            self.duplicates_dropped += 1
+            return 'duplicate'
+        
+        # Only process other sensors if combing is detected
+        if not self.combing.get((user_id, device_id), False):
+            if self.verbose:
+                print("Not combing, ignoring sensor data")
+            return 'not_combing'
+        return None
+    
+    def _remember(self, data, user_id, device_id):
+        """Add a stored message's id to the dedup window"""
+        msg_id = data.get('msg_id')
+        if msg_id is not None:
+            self.dedup.add((user_id, device_id), msg_id)
+    
+    def _normalize(self, data, user_id, device_id, timestamp):
+        """Build the sensor_data document from a raw payload"""
+        # Get raw values
+        light_raw = data.get('light', 0)
+        moisture_raw = data.get('moisture', 0)
+        
+        # Convert to percentages if needed (handle both raw ADC and percentage values)
+        light_value = self._convert_light_value(light_raw)
+        # For moisture, use the same inverted conversion logic
+        if moisture_raw > 100:
+            moisture_value = ((4095.0 - moisture_raw) / 4095.0) * 100.0
+        else:
+            moisture_value = moisture_raw
+        moisture_value = max(0, min(100, moisture_value))
+        
+        sensor_data = {
+            'user_id': user_id,
+            'device_id': device_id,
+            'role': data.get('role', 'user'),
+            'temperature': data.get('temperature', 0),
+            'light': light_value,  # Store as percentage (0-100)
+            'moisture': moisture_value,  # Store as percentage (0-100)
+            'moisture_status': self._determine_moisture_status(moisture_raw),
+            'ir_sensor': data.get('ir', 0),
+            'timestamp': timestamp
+        }
+        msg_id = data.get('msg_id')
+        if msg_id is not None:
+            sensor_data['msg_id'] = msg_id
+        return sensor_data
+    
+    def metrics(self):
+        stats = self.dedup.metrics()
+        stats['duplicates_dropped'] = self.duplicates_dropped
+        stats['rejected_devices'] = self.rejected
+        return stats
+    
     def _determine_moisture_status(self, moisture_value):
         """Determine moisture status based on analog value
         Note: moisture_value can be raw ADC (0-4095) or percentage (0-100)
@@ -109,6 +229,7 @@ class MQTTClient:
         return max(0, min(100, light_percent))
     
     def start(self):
+        import paho.mqtt.client as mqtt  # deferred so importing this module stays cheap
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
@@ -1,16 +1,92 @@
+import openai
 from openai import OpenAI
 from flask import current_app
+import threading
+from resilience import ResilientCaller, RetryBudget, CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from prompt_builder import build_recommendation_messages, build_chat_messages, PromptBudgetExceeded, ChatMemory, StoredChatMemory
+
+def _is_retryable(exc):
+    """Only retry errors that indicate a slow or degraded upstream"""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
 
 class OpenAIService:
-    def __init__(self):
+    def __init__(self, config, chat_collection=None):
+        """`config` is the app config (any mapping with the OPENAI_* and CHAT_* keys)
+
+        With `chat_collection`, conversation memory lives in that MongoDB
+        collection so every worker sees the same history; otherwise it is
+        kept in this process.
+        """
         self.client = None
-        try:
-            from config import Config
-            api_key = Config.OPENAI_API_KEY
-            if api_key:
-                self.client = OpenAI(api_key=api_key)
-        except:
-            pass
+        self.prompt_token_budget = config['OPENAI_PROMPT_TOKEN_BUDGET']
+        if chat_collection is not None:
+            self.memory = StoredChatMemory(
+                chat_collection,
+                max_turns=config['CHAT_MEMORY_TURNS'],
+                summary_tokens=config['CHAT_SUMMARY_TOKENS'],
+                max_age_days=config['CHAT_MEMORY_RETENTION_DAYS']
+            )
+        else:
+            self.memory = ChatMemory(
+                max_turns=config['CHAT_MEMORY_TURNS'],
+                summary_tokens=config['CHAT_SUMMARY_TOKENS'],
+                max_users=config['CHAT_MEMORY_MAX_USERS']
+            )
+        self._usage_lock = threading.Lock()
+        self.usage = {'requests': 0, 'estimated_prompt_tokens': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.caller = ResilientCaller(
+            timeout=config['OPENAI_TIMEOUT'],
+            max_attempts=config['OPENAI_MAX_ATTEMPTS'],
+            retry_budget=RetryBudget(ratio=config['OPENAI_RETRY_BUDGET_RATIO']),
+            breaker=CircuitBreaker(
+                failure_threshold=config['OPENAI_BREAKER_FAILURES'],
+                reset_timeout=config['OPENAI_BREAKER_RESET']
+            ),
+            is_retryable=_is_retryable
+        )
+        api_key = config['OPENAI_API_KEY']
+        if api_key:
+            try:
+                # Retries are owned by the resilience layer, not the SDK
+                self.client = OpenAI(
+                    api_key=api_key,
+                    base_url=config['OPENAI_BASE_URL'],
+                    timeout=config['OPENAI_TIMEOUT'],
+                    max_retries=0
+                )
+            except Exception as e:
+                print(f"[OPENAI] Client not configured: {e}")
+    
+    def _create_completion(self, **kwargs):
+        """Call chat.completions.create under the deadline, retry budget and breaker"""
+        return self.caller.call(self.client.chat.completions.create, **kwargs)
+    
+    def _record_usage(self, estimated_prompt_tokens, response):
+        """Track estimated and reported token usage per call"""
+        usage = getattr(response, 'usage', None)
+        with self._usage_lock:
+            self.usage['requests'] += 1
+            self.usage['estimated_prompt_tokens'] += estimated_prompt_tokens
+            if usage is not None:
+                self.usage['prompt_tokens'] += usage.prompt_tokens or 0
+                self.usage['completion_tokens'] += usage.completion_tokens or 0
+    
+    def clear_conversation(self, user_id):
+        """Forget a user's chat history"""
+        self.memory.clear(user_id)
+    
+    def metrics(self):
+        """Resilience layer state and token usage for the metrics endpoint"""
+        stats = self.caller.metrics()
+        stats['configured'] = self.client is not None
+        with self._usage_lock:
+            stats['usage'] = dict(self.usage)
+        stats['chat_memory'] = self.memory.metrics()
+        return stats
     
     def get_recommendations(self, temperature, light, moisture, moisture_status, role, age=None):
         """Generate product recommendations based on sensor data, user role, and age"""
@@ -27,96 +103,18 @@ class OpenAIService:
             }
         
         try:
-            age_info = ""
-            if age:
-                age_info = f"\nAge: {age} years old"
-                if role == 'child':
-                    if age < 3:
-                        age_info += " (toddler - use gentle, tear-free products)"
-                    elif age < 12:
-                        age_info += " (child - use mild, safe products)"
-                    else:
-                        age_info += " (teenager - may need specialized products)"
-                elif role in ['mother', 'father']:
-                    if age < 30:
-                        age_info += " (young adult)"
-                    elif age < 50:
-                        age_info += " (adult)"
-                    else:
-                        age_info += " (mature - may need age-appropriate products)"
-            
-            prompt = f"""Based on the following hair sensor data, provide personalized hair product recommendations:
-
-Sensor Readings:
-- Temperature: {temperature}°C (indicates scalp heat/irritation level)
-- Light Sensor: {light} (indicates hair density - higher values mean denser hair)
-- Moisture Level: {moisture}% (moisture reading)
-- Moisture Status: {moisture_status} (oily/dry/normal)
-
-User Role: {role} (mother/father/child){age_info}
-
-Please provide:
-1. 3-5 specific product recommendations (shampoo, conditioner, treatments) that are age-appropriate
-2. Brief reasoning for each recommendation, considering both sensor data and age
-3. Key beneficial ingredients/chemicals that should be in the products (e.g., keratin, biotin, argan oil, salicylic acid, etc.)
-4. General hair care tips based on the readings and age
-
-IMPORTANT: 
-- For each product recommendation, provide a clear, searchable product name that can be used to search on Amazon.
-- Consider age-appropriate products (e.g., gentle products for children, age-specific treatments for adults)
-- Take into account that different ages may have different hair care needs
-- List specific beneficial ingredients/chemicals that address the hair concerns indicated by the sensor data
-- Explain why each ingredient is beneficial for the specific hair condition
-
-Format your response as a JSON object with:
-- "recommendations": array of objects, each with:
-  - "name": clear product name (e.g., "Clarifying Shampoo for Oily Hair", "Moisturizing Conditioner")
-  - "type": product type (e.g., "shampoo", "conditioner", "treatment")
-  - "reason": brief explanation why this product is recommended (mention age if relevant)
-  - "key_ingredients": array of key beneficial ingredients/chemicals in this product (e.g., ["salicylic acid", "tea tree oil", "niacinamide"])
-- "beneficial_ingredients": array of objects, each with:
-  - "name": ingredient/chemical name (e.g., "Keratin", "Biotin", "Argan Oil", "Salicylic Acid")
-  - "benefit": brief explanation of why this ingredient is beneficial for the current hair condition
-  - "found_in": what type of products typically contain this (e.g., "shampoos, conditioners, treatments")
-- "tips": array of general hair care tips
-- "reasoning": brief explanation of the analysis
-
-Example format:
-{{
-  "recommendations": [
-    {{
-      "name": "Clarifying Shampoo for Oily Hair",
-      "type": "shampoo",
-      "reason": "Helps remove excess oil and buildup",
-      "key_ingredients": ["salicylic acid", "tea tree oil", "niacinamide"]
-    }}
-  ],
-  "beneficial_ingredients": [
-    {{
-      "name": "Salicylic Acid",
-      "benefit": "Helps exfoliate scalp and remove excess oil and dead skin cells",
-      "found_in": "shampoos, scalp treatments"
-    }},
-    {{
-      "name": "Tea Tree Oil",
-      "benefit": "Antimicrobial properties help control scalp oil production",
-      "found_in": "shampoos, conditioners"
-    }}
-  ],
-  "tips": ["Wash hair every other day", "Use lukewarm water"],
-  "reasoning": "Based on high moisture readings indicating oily scalp"
-}}
-"""
+            messages, prompt_tokens = build_recommendation_messages(
+                temperature, light, moisture, moisture_status, role, age,
+                token_budget=self.prompt_token_budget
+            )
 
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a hair care expert and cosmetic chemist providing personalized product recommendations and ingredient analysis based on sensor data. Always provide specific, scientifically-backed ingredient recommendations."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=messages,
                 max_tokens=800,
                 temperature=0.7
             )
+            self._record_usage(prompt_tokens, response)
             
             result_text = response.choices[0].message.content
             
@@ -130,6 +128,24 @@ Example format:
                     'reasoning': 'AI-generated recommendations based on sensor data'
                 }
                 
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            return {
+                'recommendations': [
+                    'The recommendation service is temporarily unavailable, please try again shortly',
+                    'For oily hair: Use clarifying shampoo',
+                    'For dry hair: Use moisturizing conditioner'
+                ],
+                'reasoning': f'Upstream degraded: {str(e)}'
+            }
+        except PromptBudgetExceeded as e:
+            return {
+                'recommendations': [
+                    'The request was too large to process',
+                    'For oily hair: Use clarifying shampoo',
+                    'For dry hair: Use moisturizing conditioner'
+                ],
+                'reasoning': str(e)
+            }
         except Exception as e:
             return {
                 'recommendations': [
@@ -140,39 +156,40 @@ Example format:
                 'reasoning': 'Error occurred'
             }
     
-    def chat(self, message, sensor_data=None):
-        """Handle chatbot queries about hair health"""
+    def chat(self, message, sensor_data=None, user_id=None):
+        """Handle chatbot queries about hair health
+
+        When user_id is given, earlier turns from that user's conversation
+        memory are included so follow-up questions keep their context.
+        """
         
         if not self.client:
             return "I'm sorry, the AI service is not configured. Please set up your OpenAI API key."
         
         try:
-            context = ""
-            if sensor_data:
-                context = f"""
-Recent sensor readings:
-- Temperature: {sensor_data.get('temperature', 'N/A')}°C
-- Light (Density): {sensor_data.get('light', 'N/A')}
-- Moisture: {sensor_data.get('moisture_status', 'N/A')}
-"""
-            
-            prompt = f"""You are a helpful hair care assistant for a smart comb monitoring system. 
-{context}
-Answer the user's question about hair health, monitoring, or the smart comb system in a friendly and informative way.
-Keep responses concise and practical."""
+            history = self.memory.get(user_id) if user_id else None
+            messages, prompt_tokens = build_chat_messages(
+                message, sensor_data, history,
+                token_budget=self.prompt_token_budget
+            )
 
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": message}
-                ],
+                messages=messages,
                 max_tokens=300,
                 temperature=0.7
             )
+            self._record_usage(prompt_tokens, response)
             
-            return response.choices[0].message.content
+            reply = response.choices[0].message.content
+            if user_id:
+                self.memory.append(user_id, message, reply)
+            return reply
             
+        except (CircuitOpenError, DeadlineExceeded):
+            return "I'm sorry, the AI service is responding slowly right now. Please try again in a moment."
+        except PromptBudgetExceeded:
+            return "I'm sorry, your message is too long. Please try a shorter question."
         except Exception as e:
             return f"I'm sorry, I encountered an error: {str(e)}. Please try again later."
 
@@ -0,0 +1,359 @@
+"""
+Prompt construction for the OpenAI service.
+
+Static instructions live in module-level constants so every request starts
+with an identical prefix (friendly to upstream prompt caching); only the
+sensor readings and conversation history vary. Token counts are measured
+per prompt and a budget is enforced before anything is sent.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+RECOMMENDATION_SYSTEM_PROMPT = """You are a hair care expert and cosmetic chemist providing personalized product recommendations and ingredient analysis based on sensor data. Always provide specific, scientifically-backed ingredient recommendations.
+
+You will receive hair sensor readings and the user's role (mother/father/child), optionally with their age.
+
+Sensor meanings:
+- Temperature (°C): indicates scalp heat/irritation level
+- Light Sensor: indicates hair density - higher values mean denser hair
+- Moisture Level (%): moisture reading
+- Moisture Status: oily/dry/normal
+
+Please provide:
+1. 3-5 specific product recommendations (shampoo, conditioner, treatments) that are age-appropriate
+2. Brief reasoning for each recommendation, considering both sensor data and age
+3. Key beneficial ingredients/chemicals that should be in the products (e.g., keratin, biotin, argan oil, salicylic acid, etc.)
+4. General hair care tips based on the readings and age
+
+IMPORTANT:
+- For each product recommendation, provide a clear, searchable product name that can be used to search on Amazon.
+- Consider age-appropriate products (e.g., gentle products for children, age-specific treatments for adults)
+- Take into account that different ages may have different hair care needs
+- List specific beneficial ingredients/chemicals that address the hair concerns indicated by the sensor data
+- Explain why each ingredient is beneficial for the specific hair condition
+
+Format your response as a JSON object with:
+- "recommendations": array of objects, each with:
+  - "name": clear product name (e.g., "Clarifying Shampoo for Oily Hair", "Moisturizing Conditioner")
+  - "type": product type (e.g., "shampoo", "conditioner", "treatment")
+  - "reason": brief explanation why this product is recommended (mention age if relevant)
+  - "key_ingredients": array of key beneficial ingredients/chemicals in this product (e.g., ["salicylic acid", "tea tree oil", "niacinamide"])
+- "beneficial_ingredients": array of objects, each with:
+  - "name": ingredient/chemical name (e.g., "Keratin", "Biotin", "Argan Oil", "Salicylic Acid")
+  - "benefit": brief explanation of why this ingredient is beneficial for the current hair condition
+  - "found_in": what type of products typically contain this (e.g., "shampoos, conditioners, treatments")
+- "tips": array of general hair care tips
+- "reasoning": brief explanation of the analysis
+
+Example format:
+{
+  "recommendations": [
+    {
+      "name": "Clarifying Shampoo for Oily Hair",
+      "type": "shampoo",
+      "reason": "Helps remove excess oil and buildup",
+      "key_ingredients": ["salicylic acid", "tea tree oil", "niacinamide"]
+    }
+  ],
+  "beneficial_ingredients": [
+    {
+      "name": "Salicylic Acid",
+      "benefit": "Helps exfoliate scalp and remove excess oil and dead skin cells",
+      "found_in": "shampoos, scalp treatments"
+    },
+    {
+      "name": "Tea Tree Oil",
+      "benefit": "Antimicrobial properties help control scalp oil production",
+      "found_in": "shampoos, conditioners"
+    }
+  ],
+  "tips": ["Wash hair every other day", "Use lukewarm water"],
+  "reasoning": "Based on high moisture readings indicating oily scalp"
+}"""
+
+CHAT_SYSTEM_PROMPT = """You are a helpful hair care assistant for a smart comb monitoring system.
+Answer the user's question about hair health, monitoring, or the smart comb system in a friendly and informative way.
+Keep responses concise and practical. Use earlier turns of the conversation when the user asks a follow-up question."""
+
+# Fixed per-message overhead used by the chat format (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoder = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+
+def _get_encoder():
+    """Load a tiktoken encoder once, if tiktoken is installed"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        with _encoder_lock:
+            if not _encoder_loaded:
+                try:
+                    import tiktoken
+                    _encoder = tiktoken.get_encoding('cl100k_base')
+                except Exception:
+                    _encoder = None
+                _encoder_loaded = True
+    return _encoder
+
+def count_tokens(text):
+    """Count tokens in text (exact with tiktoken, otherwise ~4 chars per token)"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return (len(text) + 3) // 4
+
+def count_message_tokens(messages):
+    """Count tokens for a list of chat messages"""
+    return sum(count_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoder = _get_encoder()
+    if encoder is not None:
+        return encoder.decode(encoder.encode(text)[:max_tokens]) + '...'
+    return text[:max_tokens * 4] + '...'
+
+class PromptBudgetExceeded(Exception):
+    """Raised when a prompt cannot be made to fit the token budget"""
+
+def describe_age(role, age):
+    """Age line for the recommendation prompt"""
+    if not age:
+        return ""
+    age_info = f"\nAge: {age} years old"
+    if role == 'child':
+        if age < 3:
+            age_info += " (toddler - use gentle, tear-free products)"
+        elif age < 12:
+            age_info += " (child - use mild, safe products)"
+        else:
+            age_info += " (teenager - may need specialized products)"
+    elif role in ['mother', 'father']:
+        if age < 30:
+            age_info += " (young adult)"
+        elif age < 50:
+            age_info += " (adult)"
+        else:
+            age_info += " (mature - may need age-appropriate products)"
+    return age_info
+
+def build_recommendation_messages(temperature, light, moisture, moisture_status, role, age=None, token_budget=None):
+    """Messages for a recommendation request: static system prefix + readings"""
+    readings = f"""Based on the following hair sensor data, provide personalized hair product recommendations:
+
+Sensor Readings:
+- Temperature: {temperature}°C
+- Light Sensor: {light}
+- Moisture Level: {moisture}%
+- Moisture Status: {moisture_status}
+
+User Role: {role}{describe_age(role, age)}"""
+
+    messages = [
+        {"role": "system", "content": RECOMMENDATION_SYSTEM_PROMPT},
+        {"role": "user", "content": readings}
+    ]
+    tokens = count_message_tokens(messages)
+    if token_budget and tokens > token_budget:
+        raise PromptBudgetExceeded(f"Recommendation prompt is {tokens} tokens, budget is {token_budget}")
+    return messages, tokens
+
+def format_sensor_context(sensor_data):
+    """Short description of the latest reading for the chat prompt"""
+    if not sensor_data:
+        return ""
+    return f"""Recent sensor readings:
+- Temperature: {sensor_data.get('temperature', 'N/A')}°C
+- Light (Density): {sensor_data.get('light', 'N/A')}
+- Moisture: {sensor_data.get('moisture_status', 'N/A')}"""
+
+def build_chat_messages(message, sensor_data=None, history=None, token_budget=None):
+    """Messages for a chat request
+
+    Order is static system prompt, dynamic context (sensor readings and the
+    summary of older turns), recent turns, then the new question. When the
+    budget is exceeded the oldest turns are dropped first, then the summary.
+    """
+    summary = history['summary'] if history else ""
+    turns = list(history['turns']) if history else []
+
+    def assemble():
+        context_parts = [part for part in (format_sensor_context(sensor_data), summary and f"Summary of earlier conversation:\n{summary}") if part]
+        messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+        if context_parts:
+            messages.append({"role": "system", "content": "\n\n".join(context_parts)})
+        for user_text, assistant_text in turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": assistant_text})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    messages = assemble()
+    tokens = count_message_tokens(messages)
+    while token_budget and tokens > token_budget and (turns or summary):
+        if turns:
+            turns.pop(0)
+        else:
+            summary = ""
+        messages = assemble()
+        tokens = count_message_tokens(messages)
+
+    if token_budget and tokens > token_budget:
+        raise PromptBudgetExceeded(f"Chat prompt is {tokens} tokens, budget is {token_budget}")
+    return messages, tokens
+
+class ChatMemory:
+    """Bounded per-user conversation memory for the chatbot
+
+    Keeps the most recent `max_turns` exchanges verbatim per user. Older
+    exchanges are compacted into a short running summary capped at
+    `summary_tokens`. At most `max_users` conversations are held; the least
+    recently used is evicted first.
+    """
+
+    def __init__(self, max_turns=6, summary_tokens=300, max_users=1000, turn_chars=160):
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.max_users = max_users
+        self.turn_chars = turn_chars
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self.compactions = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Snapshot of a user's conversation: {'summary': str, 'turns': [(user, assistant), ...]}"""
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                return {'summary': "", 'turns': []}
+            self._conversations.move_to_end(user_id)
+            return {'summary': conversation['summary'], 'turns': list(conversation['turns'])}
+
+    def append(self, user_id, user_text, assistant_text):
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                conversation = {'summary': "", 'turns': deque()}
+                self._conversations[user_id] = conversation
+                if len(self._conversations) > self.max_users:
+                    self._conversations.popitem(last=False)
+                    self.evictions += 1
+            self._conversations.move_to_end(user_id)
+            self.compactions += self._add_turn(conversation, user_text, assistant_text)
+
+    def _add_turn(self, conversation, user_text, assistant_text):
+        """Append an exchange, folding the oldest into the summary; returns the number folded"""
+        conversation['turns'].append((user_text, assistant_text))
+        folded = 0
+        while len(conversation['turns']) > self.max_turns:
+            old_user, old_assistant = conversation['turns'].popleft()
+            conversation['summary'] = self._compact(conversation['summary'], old_user, old_assistant)
+            folded += 1
+        return folded
+
+    def clear(self, user_id):
+        with self._lock:
+            self._conversations.pop(user_id, None)
+
+    def _compact(self, summary, user_text, assistant_text):
+        """Fold one exchange into the summary, keeping the newest content within budget"""
+        line = f"- User asked: {self._shorten(user_text)} / Assistant: {self._shorten(assistant_text)}"
+        lines = (summary.split('\n') if summary else []) + [line]
+        while len(lines) > 1 and count_tokens('\n'.join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return truncate_to_tokens('\n'.join(lines), self.summary_tokens)
+
+    def _shorten(self, text):
+        text = ' '.join(text.split())
+        if len(text) <= self.turn_chars:
+            return text
+        return text[:self.turn_chars] + '...'
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'conversations': len(self._conversations),
+                'compactions': self.compactions,
+                'evictions': self.evictions
+            }
+
+class StoredChatMemory(ChatMemory):
+    """ChatMemory kept in a MongoDB collection, shared by every web worker
+
+    One document per user holds the summary and recent turns. Writes are
+    versioned, so two workers answering the same user at once don't lose a
+    turn. Conversations idle for `max_age_days` expire through a TTL index.
+    """
+
+    def __init__(self, collection, max_turns=6, summary_tokens=300, turn_chars=160, max_age_days=30, max_attempts=3):
+        super().__init__(max_turns=max_turns, summary_tokens=summary_tokens, turn_chars=turn_chars)
+        self.collection = collection
+        self.max_age_days = max_age_days
+        self.max_attempts = max_attempts
+        self.conflicts = 0
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index('user_id', unique=True)
+            if self.max_age_days:
+                self.collection.create_index('updated_at', expireAfterSeconds=int(self.max_age_days * 86400))
+            self._indexed = True
+
+    def get(self, user_id):
+        doc = self.collection.find_one({'user_id': user_id}, {'summary': 1, 'turns': 1})
+        if doc is None:
+            return {'summary': "", 'turns': []}
+        return {'summary': doc.get('summary', ""), 'turns': [tuple(turn) for turn in doc.get('turns', [])]}
+
+    def append(self, user_id, user_text, assistant_text):
+        self._ensure_index()
+        for _ in range(self.max_attempts):
+            doc = self.collection.find_one({'user_id': user_id}) or {}
+            version = doc.get('version', 0)
+            conversation = {
+                'summary': doc.get('summary', ""),
+                'turns': deque(tuple(turn) for turn in doc.get('turns', []))
+            }
+            folded = self._add_turn(conversation, user_text, assistant_text)
+            try:
+                # Matches nothing if another worker wrote first; the upsert then
+                # hits the unique user_id index and we retry on the newer version
+                self.collection.update_one(
+                    {'user_id': user_id, 'version': version},
+                    {'$set': {
+                        'summary': conversation['summary'],
+                        'turns': [list(turn) for turn in conversation['turns']],
+                        'version': version + 1,
+                        'updated_at': datetime.utcnow()
+                    }},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                with self._lock:
+                    self.conflicts += 1
+                continue
+            with self._lock:
+                self.compactions += folded
+            return
+
+    def clear(self, user_id):
+        self.collection.delete_one({'user_id': user_id})
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'backend': 'mongodb',
+                'compactions': self.compactions,
+                'conflicts': self.conflicts
+            }
@@ -0,0 +1,322 @@
+"""
+Per-user admission control for the expensive endpoints.
+
+Each (user, endpoint class) pair gets a token bucket: `limit` requests
+per `period`, refilled continuously, so a user can burst up to `limit`
+and then proceeds at the steady rate. Buckets live in process memory, or
+in Redis when a shared backend URL is configured so every worker sees the
+same counts. If Redis is unreachable, checks fall back to the in-process
+buckets rather than rejecting traffic.
+
+Separately, ConcurrencyLimiter caps how many LLM calls run at once and
+sheds the excess instead of queueing it. With the same Redis URL the cap
+holds across all workers; otherwise it applies to each process.
+"""
+
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+def parse_limit(value):
+    """'10/minute' -> (10, 60.0); falsy or '0/...' disables the limit (None)"""
+    if not value:
+        return None
+    count, _, period = value.partition('/')
+    count = int(count)
+    if count <= 0:
+        return None
+    if period not in PERIODS:
+        raise ValueError(f"Invalid rate limit period in '{value}' (use second, minute or hour)")
+    return count, float(PERIODS[period])
+
+class MemoryBuckets:
+    """Token buckets in process memory, least recently used evicted first"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        """Take one token; returns (allowed, seconds until a token is available)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, retry_after
+
+    def refund(self, key, capacity):
+        """Give back a token taken for a request that was not served"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + 1), updated)
+
+    def __len__(self):
+        return len(self._buckets)
+
+# Same algorithm as MemoryBuckets, atomic in Redis; time comes from the
+# Redis server so workers with skewed clocks share one timeline
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+_REDIS_REFUND = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+return 1
+"""
+
+def _redis_client(url):
+    import redis  # optional dependency, only needed for a shared backend
+    return redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+
+class RedisBuckets:
+    """Token buckets shared between processes through Redis"""
+
+    def __init__(self, url, prefix='smartcomb:ratelimit:'):
+        self.client = _redis_client(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(_REDIS_TAKE)
+        self._refund = self.client.register_script(_REDIS_REFUND)
+
+    def take(self, key, capacity, rate, now=None):
+        allowed, retry_after = self._take(keys=[self.prefix + key], args=[capacity, rate])
+        return bool(allowed), float(retry_after)
+
+    def refund(self, key, capacity):
+        self._refund(keys=[self.prefix + key], args=[capacity])
+
+class RateLimiter:
+    """Token-bucket limits per user and endpoint class
+
+    `limits` maps an endpoint class to (requests, period seconds); classes
+    without an entry are not limited.
+    """
+
+    def __init__(self, limits, storage_url=None):
+        self.limits = {name: limit for name, limit in limits.items() if limit}
+        self.local = MemoryBuckets()
+        self.shared = None
+        self.backend = 'memory'
+        if storage_url:
+            try:
+                self.shared = RedisBuckets(storage_url)
+                self.backend = 'redis'
+            except Exception as e:
+                print(f"[RATELIMIT] Shared backend unavailable ({e}); using in-process buckets")
+        self._lock = threading.Lock()
+        self.allowed = defaultdict(int)
+        self.throttled = defaultdict(int)
+        self.refunded = defaultdict(int)
+        self.backend_errors = 0
+        self.last_backend_error = None
+
+    def check(self, user_id, endpoint_class):
+        """Admit one request; returns (allowed, Retry-After seconds)"""
+        limit = self.limits.get(endpoint_class)
+        if limit is None:
+            return True, 0.0
+        count, period = limit
+        key = f"{endpoint_class}:{user_id}"
+        rate = count / period
+        if self.shared is not None:
+            try:
+                allowed, retry_after = self.shared.take(key, count, rate)
+            except Exception as e:
+                with self._lock:
+                    self.backend_errors += 1
+                    self.last_backend_error = str(e)
+                allowed, retry_after = self.local.take(key, count, rate)
+        else:
+            allowed, retry_after = self.local.take(key, count, rate)
+        with self._lock:
+            if allowed:
+                self.allowed[endpoint_class] += 1
+            else:
+                self.throttled[endpoint_class] += 1
+        return allowed, retry_after
+
+    def refund(self, user_id, endpoint_class):
+        """Return the token of an admitted request that was shed before doing any work"""
+        limit = self.limits.get(endpoint_class)
+        if limit is None:
+            return
+        key = f"{endpoint_class}:{user_id}"
+        if self.shared is not None:
+            try:
+                self.shared.refund(key, limit[0])
+            except Exception as e:
+                with self._lock:
+                    self.backend_errors += 1
+                    self.last_backend_error = str(e)
+                self.local.refund(key, limit[0])
+        else:
+            self.local.refund(key, limit[0])
+        with self._lock:
+            self.refunded[endpoint_class] += 1
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'limits': {name: {'requests': count, 'period': period} for name, (count, period) in self.limits.items()},
+                'allowed': dict(self.allowed),
+                'throttled': dict(self.throttled),
+                'refunded': dict(self.refunded),
+                'tracked_buckets': len(self.local),
+                'backend_errors': self.backend_errors,
+                'last_backend_error': self.last_backend_error
+            }
+
+# Leases are members of a sorted set scored by their expiry; expired ones
+# (from a worker that died mid-call) are dropped before counting
+_REDIS_ACQUIRE = """
+local limit = tonumber(ARGV[1])
+local lease_seconds = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + lease_seconds, ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(lease_seconds) + 1)
+return 1
+"""
+
+class RedisLeases:
+    """A concurrency cap shared between processes through Redis"""
+
+    def __init__(self, url, lease_seconds, key='smartcomb:concurrency:llm'):
+        self.client = _redis_client(url)
+        self.lease_seconds = lease_seconds
+        self.key = key
+        self._acquire = self.client.register_script(_REDIS_ACQUIRE)
+
+    def acquire(self, limit):
+        """A lease id, or None if `limit` leases are already held"""
+        lease = uuid.uuid4().hex
+        if self._acquire(keys=[self.key], args=[limit, self.lease_seconds, lease]):
+            return lease
+        return None
+
+    def release(self, lease):
+        self.client.zrem(self.key, lease)
+
+# Lease for a slot counted only in this process
+LOCAL_LEASE = 'local'
+
+class ConcurrencyLimiter:
+    """At most `max_concurrent` holders at once; extra callers are shed, not queued
+
+    With a storage URL the cap is shared by every process through Redis
+    leases, which expire after `lease_seconds` in case the holder dies
+    without releasing. If Redis is unreachable, the cap falls back to this
+    process.
+    """
+
+    def __init__(self, max_concurrent, retry_after=1.0, storage_url=None, lease_seconds=60):
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.shared = None
+        self.backend = 'memory'
+        if storage_url and max_concurrent > 0:
+            try:
+                self.shared = RedisLeases(storage_url, lease_seconds)
+                self.backend = 'redis'
+            except Exception as e:
+                print(f"[RATELIMIT] Shared backend unavailable ({e}); capping LLM calls per process")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.shed = 0
+        self.backend_errors = 0
+        self.last_backend_error = None
+
+    def try_acquire(self):
+        """A lease to pass to release(), or None if the cap is reached"""
+        lease = LOCAL_LEASE
+        if self.shared is not None:
+            try:
+                lease = self.shared.acquire(self.max_concurrent)
+            except Exception as e:
+                with self._lock:
+                    self.backend_errors += 1
+                    self.last_backend_error = str(e)
+                lease = LOCAL_LEASE
+            else:
+                if lease is None:
+                    with self._lock:
+                        self.shed += 1
+                    return None
+        with self._lock:
+            if lease == LOCAL_LEASE and self.max_concurrent > 0 and self.in_flight >= self.max_concurrent:
+                self.shed += 1
+                return None
+            self.in_flight += 1
+            self.admitted += 1
+            self.peak = max(self.peak, self.in_flight)
+            return lease
+
+    def release(self, lease):
+        with self._lock:
+            self.in_flight -= 1
+        if lease != LOCAL_LEASE:
+            try:
+                self.shared.release(lease)
+            except Exception as e:
+                # The lease expires on its own
+                with self._lock:
+                    self.backend_errors += 1
+                    self.last_backend_error = str(e)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'peak': self.peak,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'backend_errors': self.backend_errors,
+                'last_backend_error': self.last_backend_error
+            }
+
+def retry_after_header(seconds):
+    """Retry-After takes whole seconds; round up so clients don't retry too early"""
+    return str(max(1, math.ceil(seconds)))
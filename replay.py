@@ -0,0 +1,351 @@
+"""
+Brokerless Ingest Replay
+Feeds recorded or synthetic MQTT message streams straight into
+MQTTClient.ingest, without a broker, and reports per-stage timings
+(decode, gate, normalize, write).
+
+Stream files are JSONL, one message per line:
+    {"topic": "smartcomb/<user_id>/<device_id>/sensors", "payload": {...}, "ts": 1735689600.0}
+`payload` may be a JSON object or a raw string; `ts` is epoch seconds.
+
+Usage:
+    # Generate a synthetic stream (20 devices, 10 minutes, 5% redeliveries)
+    python replay.py generate --devices 20 --duration 600 --duplicate-rate 0.05 --out stream.jsonl
+
+    # Record a live stream from a broker
+    python replay.py record --broker localhost --out stream.jsonl
+
+    # Replay as fast as possible into an in-memory store, with cProfile output
+    python replay.py run stream.jsonl --speed max --profile ingest.prof
+
+    # Replay at 10x real time into a local mongod
+    python replay.py run stream.jsonl --speed 10 --mongo-uri mongodb://localhost:27017/smartcomb_replay
+"""
+
+import argparse
+import cProfile
+import pstats
+import random
+import sys
+import time
+import types
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Flask
+
+from config import Config
+from device_registry import DeviceRegistry
+from mqtt_client import MQTTClient
+from serialization import dumps, dumps_bytes, loads
+import topics
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        self.docs.sort(key=lambda d: d.get(key), reverse=direction == -1)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+class MemoryCollection:
+    """Just enough of a PyMongo collection for the ingest path"""
+
+    def __init__(self):
+        self.docs = []
+
+    @staticmethod
+    def _matches(doc, query):
+        return all(doc.get(k) == v for k, v in (query or {}).items())
+
+    def insert_one(self, doc):
+        doc.setdefault('_id', ObjectId())
+        self.docs.append(doc)
+        return types.SimpleNamespace(inserted_id=doc['_id'])
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                return doc
+        return None
+
+    def find(self, query=None, projection=None):
+        return MemoryCursor([d for d in self.docs if self._matches(d, query)])
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.find_one(query)
+        if doc is None:
+            if not upsert:
+                return types.SimpleNamespace(matched_count=0)
+            doc = dict(query)
+            doc.update(update.get('$setOnInsert', {}))
+            self.insert_one(doc)
+        doc.update(update.get('$set', {}))
+        return types.SimpleNamespace(matched_count=1)
+
+    def delete_one(self, query):
+        doc = self.find_one(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return types.SimpleNamespace(deleted_count=1 if doc is not None else 0)
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+    def count_documents(self, query):
+        return sum(1 for d in self.docs if self._matches(d, query))
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = defaultdict(MemoryCollection)
+
+    def __getattr__(self, name):
+        return self._collections[name]
+
+    def __getitem__(self, name):
+        return self._collections[name]
+
+class MemoryStore:
+    """In-memory stand-in for flask_pymongo.PyMongo (`store.db.<collection>`)"""
+
+    def __init__(self):
+        self.db = MemoryDatabase()
+
+class StageTimer:
+    """Collects per-stage durations reported by MQTTClient.ingest"""
+
+    STAGES = ('decode', 'gate', 'normalize', 'write')
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def __call__(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def report(self):
+        print(f"{'stage':>10} {'count':>9} {'total ms':>10} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9}")
+        for stage in self.STAGES:
+            values = sorted(self.samples.get(stage, []))
+            if not values:
+                continue
+            count = len(values)
+            pct = lambda p: values[min(count - 1, int(p * count))] * 1e6
+            print(f"{stage:>10} {count:>9} {sum(values) * 1000:>10.1f} {sum(values) / count * 1e6:>9.1f} "
+                  f"{pct(0.50):>9.1f} {pct(0.95):>9.1f} {pct(0.99):>9.1f}")
+
+def to_messages(records):
+    """Stream records ({'ts', 'topic', 'payload'}) as (ts, topic, payload bytes) tuples, oldest first"""
+    messages = []
+    for record in records:
+        payload = record['payload']
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        else:
+            payload = dumps_bytes(payload)
+        messages.append((float(record.get('ts', 0)), record['topic'], payload))
+    messages.sort(key=lambda m: m[0])
+    return messages
+
+def load_stream(path):
+    """Read a JSONL stream into (ts, topic, payload bytes) tuples"""
+    with open(path, 'rb') as f:
+        return to_messages(loads(line) for line in f if line.strip())
+
+def generate_stream(devices, duration, interval=2.0, combing_ratio=0.7, duplicate_rate=0.0, seed=None):
+    """Synthetic stream shaped like the ESP32: IR state plus a reading every interval"""
+    rng = random.Random(seed)
+    user_ids = [str(ObjectId()) for _ in range(max(1, devices // 2))]
+    fleet = [(rng.choice(user_ids), uuid.UUID(int=rng.getrandbits(128)).hex[:12]) for _ in range(devices)]
+    start = time.time()
+    records = []
+    for tick in range(int(duration / interval)):
+        for user_id, device_id in fleet:
+            ts = start + tick * interval + rng.uniform(0, interval)
+            combing = rng.random() < combing_ratio
+            records.append({
+                'ts': ts,
+                'topic': topics.device_topic(Config.MQTT_TOPIC_ROOT, user_id, device_id, topics.IR),
+                'payload': {'value': 1 if combing else 0}
+            })
+            if not combing:
+                continue
+            reading = {
+                'ts': ts + 0.01,
+                'topic': topics.device_topic(Config.MQTT_TOPIC_ROOT, user_id, device_id, topics.SENSORS),
+                'payload': {
+                    'msg_id': f"{device_id}-{tick}",
+                    'role': rng.choice(['mother', 'father', 'child']),
+                    'temperature': round(rng.uniform(20.0, 38.0), 1),
+                    'light': round(rng.uniform(0, 100), 1),
+                    'moisture': round(rng.uniform(0, 100), 1),
+                    'ir': 1
+                }
+            }
+            records.append(reading)
+            if rng.random() < duplicate_rate:
+                redelivery = dict(reading)
+                redelivery['ts'] = reading['ts'] + rng.uniform(0.05, 1.0)
+                records.append(redelivery)
+    records.sort(key=lambda r: r['ts'])
+    return records
+
+def build_client(mongo_uri=None):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if mongo_uri:
+        from flask_pymongo import PyMongo
+        app.config['MONGO_URI'] = mongo_uri
+        store = PyMongo(app)
+    else:
+        store = MemoryStore()
+    client = MQTTClient(app, store, DeviceRegistry(store))
+    client.verbose = False
+    return client
+
+def register_stream_devices(client, messages):
+    """Register every device in the stream to the user in its topic, as the dashboard would"""
+    devices = set()
+    for _, topic, _ in messages:
+        parsed = topics.parse_topic(client.topic_root, topic)
+        if parsed:
+            devices.add(parsed[:2])
+    for user_id, device_id in devices:
+        client.registry.register(user_id, device_id)
+    return len(devices)
+
+def replay(client, messages, speed, timer):
+    """Feed messages to the client; speed is a real-time factor, or None for max speed"""
+    outcomes = defaultdict(int)
+    errors = 0
+    if not messages:
+        return outcomes, errors
+    first_ts = messages[0][0]
+    wall_start = time.perf_counter()
+    for ts, topic, payload in messages:
+        if speed:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        try:
+            # Store the stream's own timestamps, not the replay wall clock
+            received_at = datetime.utcfromtimestamp(ts) if ts else None
+            outcomes[client.ingest(topic, payload, received_at=received_at, timer=timer)] += 1
+        except Exception as e:
+            errors += 1
+            if errors <= 5:
+                print(f"[REPLAY] Error ingesting message on {topic}: {e}")
+    return outcomes, errors
+
+def cmd_run(args):
+    messages = load_stream(args.stream)
+    speed = None if args.speed == 'max' else float(args.speed)
+    client = build_client(args.mongo_uri)
+    register_stream_devices(client, messages)
+    timer = StageTimer()
+
+    print(f"Replaying {len(messages)} messages from {args.stream} "
+          f"({'max speed' if speed is None else f'{speed}x real time'}, "
+          f"store: {'mongodb' if args.mongo_uri else 'memory'})")
+
+    profiler = cProfile.Profile() if args.profile else None
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    outcomes, errors = replay(client, messages, speed, timer)
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+
+    print("=" * 72)
+    print(f"Elapsed: {elapsed:.2f}s  Throughput: {len(messages) / elapsed:,.0f} msg/s  Errors: {errors}")
+    print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+    print("=" * 72)
+    timer.report()
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print("=" * 72)
+        print(f"cProfile output written to {args.profile}")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+def cmd_generate(args):
+    records = generate_stream(args.devices, args.duration, args.interval, args.combing_ratio,
+                              args.duplicate_rate, args.seed)
+    with open(args.out, 'w') as f:
+        for record in records:
+            f.write(dumps(record) + '\n')
+    print(f"Wrote {len(records)} messages to {args.out}")
+
+def cmd_record(args):
+    import paho.mqtt.client as mqtt
+
+    out = open(args.out, 'w')
+    count = 0
+
+    def on_connect(client, userdata, flags, rc):
+        for topic in topics.server_subscriptions(Config.MQTT_TOPIC_ROOT):
+            client.subscribe(topic)
+        print(f"Recording from {args.broker}:{args.port} to {args.out} (Ctrl+C to stop)")
+
+    def on_message(client, userdata, msg):
+        nonlocal count
+        try:
+            payload = loads(msg.payload)
+        except Exception:
+            payload = msg.payload.decode('utf-8', errors='replace')
+        out.write(dumps({'ts': time.time(), 'topic': msg.topic, 'payload': payload}) + '\n')
+        count += 1
+
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port, 60)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        client.disconnect()
+    finally:
+        out.close()
+        print(f"\nRecorded {count} messages")
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay MQTT message streams into the ingest handler')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Replay a stream file')
+    run.add_argument('stream')
+    run.add_argument('--speed', default='max', help="Real-time factor (1 = real time, 10 = 10x) or 'max'")
+    run.add_argument('--mongo-uri', help='Write to this MongoDB instead of the in-memory store')
+    run.add_argument('--profile', help='Write cProfile stats to this file')
+    run.set_defaults(func=cmd_run)
+
+    gen = sub.add_parser('generate', help='Generate a synthetic stream file')
+    gen.add_argument('--devices', type=int, default=10)
+    gen.add_argument('--duration', type=float, default=600, help='Seconds of traffic')
+    gen.add_argument('--interval', type=float, default=2.0, help='Seconds between readings per device')
+    gen.add_argument('--combing-ratio', type=float, default=0.7)
+    gen.add_argument('--duplicate-rate', type=float, default=0.0)
+    gen.add_argument('--seed', type=int)
+    gen.add_argument('--out', required=True)
+    gen.set_defaults(func=cmd_generate)
+
+    rec = sub.add_parser('record', help='Record a live stream from a broker')
+    rec.add_argument('--broker', default=Config.MQTT_BROKER)
+    rec.add_argument('--port', type=int, default=Config.MQTT_PORT)
+    rec.add_argument('--out', required=True)
+    rec.set_defaults(func=cmd_record)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Resilience helpers for calls to slow or flaky upstream services.
+
+Provides per-call deadlines, jittered retries drawn from a shared retry
+budget, and a circuit breaker that fails fast while the upstream is degraded.
+"""
+
+import random
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the overall deadline for a call has passed"""
+
+
+class Deadline:
+    """Absolute deadline for a call, measured on the monotonic clock"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class RetryBudget:
+    """Shared budget limiting retries to a fraction of recent calls
+
+    Every first attempt deposits `ratio` tokens and every retry withdraws one,
+    so retries can never exceed roughly `ratio` of the traffic. A small
+    per-second floor keeps retries possible when traffic is low.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self.deposits = 0
+        self.withdrawals = 0
+        self.rejections = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.max_tokens, self._tokens + elapsed * self.min_per_second)
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+            self.deposits += 1
+
+    def try_withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.withdrawals += 1
+                return True
+            self.rejections += 1
+            return False
+
+    def metrics(self):
+        with self._lock:
+            self._refill()
+            return {
+                'tokens': round(self._tokens, 2),
+                'deposits': self.deposits,
+                'withdrawals': self.withdrawals,
+                'rejections': self.rejections
+            }
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call should not go through"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.rejected += 1
+            if state == self.OPEN:
+                retry_after = self.reset_timeout - (time.monotonic() - self._opened_at)
+            else:
+                retry_after = 1.0
+            raise CircuitOpenError(max(0.0, retry_after))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+
+class ResilientCaller:
+    """Runs a callable under a deadline, retry budget and circuit breaker
+
+    The wrapped function receives the remaining time in seconds as its
+    `timeout` keyword argument so it can pass it on to the client library.
+    """
+
+    def __init__(self, timeout=15.0, max_attempts=3, base_delay=0.25, max_delay=2.0,
+                 retry_budget=None, breaker=None, is_retryable=None):
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.is_retryable = is_retryable or (lambda exc: True)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+        self.total_latency = 0.0
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform between 0 and the exponential cap
+        cap = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def call(self, func, *args, timeout=None, **kwargs):
+        deadline = Deadline(timeout or self.timeout)
+        started = time.monotonic()
+        with self._lock:
+            self.calls += 1
+
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            with self._lock:
+                self.failures += 1
+            raise
+
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                result = func(*args, timeout=deadline.remaining(), **kwargs)
+            except Exception as e:
+                attempt += 1
+                can_retry = (
+                    self.is_retryable(e)
+                    and attempt < self.max_attempts
+                    and not deadline.expired()
+                )
+                delay = self._backoff(attempt) if can_retry else 0
+                if can_retry and delay < deadline.remaining() and self.retry_budget.try_withdraw():
+                    with self._lock:
+                        self.retries += 1
+                    time.sleep(delay)
+                    continue
+
+                # Non-retryable errors (bad request, auth) mean the upstream
+                # answered, so they do not count against its health
+                if self.is_retryable(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                with self._lock:
+                    self.failures += 1
+                    self.total_latency += time.monotonic() - started
+                    if deadline.expired():
+                        self.deadline_exceeded += 1
+                if deadline.expired():
+                    raise DeadlineExceeded(f"Deadline of {deadline.timeout}s exceeded") from e
+                raise
+
+            self.breaker.record_success()
+            with self._lock:
+                self.successes += 1
+                self.total_latency += time.monotonic() - started
+            return result
+
+    def metrics(self):
+        with self._lock:
+            completed = self.successes + self.failures
+            stats = {
+                'calls': self.calls,
+                'successes': self.successes,
+                'failures': self.failures,
+                'retries': self.retries,
+                'deadline_exceeded': self.deadline_exceeded,
+                'avg_latency_ms': round(self.total_latency / completed * 1000, 1) if completed else 0.0
+            }
+        stats['breaker'] = self.breaker.metrics()
+        stats['retry_budget'] = self.retry_budget.metrics()
+        return stats
@@ -0,0 +1,293 @@
+"""
+Data retention for sensor readings and recommendations.
+
+Readings older than SENSOR_DATA_RETENTION_DAYS - ARCHIVE_LEAD_DAYS are
+compacted by an archive job into compressed per-user/per-month JSONL files
+(zstd if `zstandard` is installed, gzip otherwise) and marked with
+`archived_at`. A TTL index on `archived_at` removes them ARCHIVE_LEAD_DAYS
+later, so a reading is never deleted from MongoDB before it is archived. HistoryReader serves a time range from MongoDB for recent data
+and transparently falls back to the archive for older ranges.
+
+Run the archive job by hand with:
+    python retention.py archive
+"""
+
+import gzip
+import io
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from serialization import dumps_bytes, loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_EXTENSION = '.jsonl.zst' if zstandard is not None else '.jsonl.gz'
+
+# user_id becomes a directory name, so only allow ObjectId strings
+USER_ID_PATTERN = re.compile(r'[0-9a-f]{24}')
+
+def ensure_indexes(db, sensor_days, recommendation_days, archive_lead_days=7):
+    """Create query indexes and TTL indexes, updating TTLs that changed"""
+    db.sensor_data.create_index([('user_id', ASCENDING), ('role', ASCENDING), ('timestamp', DESCENDING)])
+    # Newest reading per user, for the /api/household ETag
+    db.sensor_data.create_index([('user_id', ASCENDING), ('_id', DESCENDING)])
+    db.recommendations.create_index([('user_id', ASCENDING), ('role', ASCENDING), ('created_at', DESCENDING)])
+    # Readings only expire once the archiver has set archived_at on them
+    if 'timestamp_ttl' in db.sensor_data.index_information():
+        db.sensor_data.drop_index('timestamp_ttl')
+    if sensor_days:
+        _ensure_ttl_index(db, 'sensor_data', 'archived_at', max(0, archive_lead_days) * 86400)
+    if recommendation_days:
+        _ensure_ttl_index(db, 'recommendations', 'created_at', recommendation_days * 86400)
+
+def _ensure_ttl_index(db, collection, field, seconds):
+    seconds = int(seconds)
+    try:
+        db[collection].create_index([(field, ASCENDING)], expireAfterSeconds=seconds, name=f'{field}_ttl')
+    except OperationFailure:
+        # Index exists with a different TTL: change it in place
+        db.command('collMod', collection, index={'name': f'{field}_ttl', 'expireAfterSeconds': seconds})
+
+def _month_key(timestamp):
+    return timestamp.strftime('%Y-%m')
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data)
+
+def _decompress(data):
+    if zstandard is not None:
+        # Each archive run appends its own frame
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True)
+        return reader.read()
+    return gzip.decompress(data)
+
+def _to_record(doc):
+    record = {k: v for k, v in doc.items() if k != '_id'}
+    record['_id'] = str(doc['_id'])
+    return record
+
+def _from_record(record):
+    if isinstance(record.get('timestamp'), str):
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+    return record
+
+class Archiver:
+    """Compacts readings into per-user/per-month compressed JSONL files
+
+    Readings older than the archive cutoff without `archived_at` are
+    appended to the month files as one new compressed frame, then exactly
+    those readings are marked `archived_at` (which starts their TTL). A
+    reading stored late with an old timestamp is picked up by the next run.
+    `archive_state.archived_until` records the latest cutoff per user, so
+    history reads know when the archive might hold part of a range.
+    """
+
+    MARK_BATCH = 1000
+
+    def __init__(self, db, archive_dir, retention_days, lead_days=7):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.lead_days = lead_days
+        self.runs = 0
+        self.records_archived = 0
+        self.bytes_written = 0
+        self.last_run = None
+
+    def cutoff(self, now=None):
+        """Readings older than this are archived, then expire lead_days later"""
+        now = now or datetime.utcnow()
+        return now - timedelta(days=max(0, self.retention_days - self.lead_days))
+
+    def user_dir(self, user_id):
+        if not isinstance(user_id, str) or not USER_ID_PATTERN.fullmatch(user_id):
+            raise ValueError(f"Invalid user_id for archive path: {user_id!r}")
+        return os.path.join(self.archive_dir, user_id)
+
+    def path_for(self, user_id, month):
+        return os.path.join(self.user_dir(user_id), f"{month}{ARCHIVE_EXTENSION}")
+
+    def run(self, now=None):
+        """Archive everything older than the cutoff that is not archived yet"""
+        if not self.retention_days:
+            return 0
+        cutoff = self.cutoff(now)
+        archived = 0
+        for user_id in self.db.sensor_data.distinct('user_id', self._pending(cutoff)):
+            if not isinstance(user_id, str) or not USER_ID_PATTERN.fullmatch(user_id):
+                print(f"[RETENTION] Skipping readings with invalid user_id {user_id!r}")
+                continue
+            archived += self.archive_user(user_id, cutoff)
+        self.runs += 1
+        self.last_run = datetime.utcnow()
+        print(f"[RETENTION] Archived {archived} readings older than {cutoff.isoformat()}")
+        return archived
+
+    def _pending(self, cutoff):
+        return {'timestamp': {'$lt': cutoff}, 'archived_at': {'$exists': False}}
+
+    def archive_user(self, user_id, cutoff):
+        query = self._pending(cutoff)
+        query['user_id'] = user_id
+
+        by_month = {}
+        ids = []
+        for doc in self.db.sensor_data.find(query).sort('timestamp', ASCENDING):
+            by_month.setdefault(_month_key(doc['timestamp']), []).append(dumps_bytes(_to_record(doc)))
+            ids.append(doc['_id'])
+
+        count = 0
+        for month, lines in by_month.items():
+            path = self.path_for(user_id, month)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            frame = _compress(b'\n'.join(lines) + b'\n')
+            with open(path, 'ab') as f:
+                f.write(frame)
+            self.bytes_written += len(frame)
+            count += len(lines)
+
+        # Only the readings just written; anything inserted since the find
+        # waits for the next run
+        archived_at = datetime.utcnow()
+        for i in range(0, len(ids), self.MARK_BATCH):
+            self.db.sensor_data.update_many(
+                {'_id': {'$in': ids[i:i + self.MARK_BATCH]}},
+                {'$set': {'archived_at': archived_at}}
+            )
+        self.db.archive_state.update_one(
+            {'user_id': user_id},
+            {'$max': {'archived_until': cutoff}, '$set': {'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+        self.records_archived += count
+        return count
+
+    def read(self, user_id, start=None, end=None, role=None):
+        """Archived readings for a user in [start, end), oldest first"""
+        user_dir = self.user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+
+        first_month = _month_key(start) if start else None
+        last_month = _month_key(end) if end else None
+        results = []
+        for name in sorted(os.listdir(user_dir)):
+            if not name.endswith(ARCHIVE_EXTENSION):
+                continue
+            month = name[:-len(ARCHIVE_EXTENSION)]
+            if (first_month and month < first_month) or (last_month and month > last_month):
+                continue
+            with open(os.path.join(user_dir, name), 'rb') as f:
+                data = _decompress(f.read())
+            for line in data.splitlines():
+                if not line:
+                    continue
+                record = _from_record(loads(line))
+                if role and record.get('role') != role:
+                    continue
+                timestamp = record.get('timestamp')
+                if start and timestamp < start:
+                    continue
+                if end and timestamp >= end:
+                    continue
+                results.append(record)
+        results.sort(key=lambda r: r['timestamp'])
+        return results
+
+    def metrics(self):
+        return {
+            'runs': self.runs,
+            'records_archived': self.records_archived,
+            'bytes_written': self.bytes_written,
+            'last_run': self.last_run,
+            'codec': 'zstd' if zstandard is not None else 'gzip'
+        }
+
+    def run_forever(self, interval):
+        """Run the archive job every `interval` seconds (for a daemon thread)"""
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                print(f"[RETENTION] Archive run failed: {e}")
+            time.sleep(interval)
+
+
+class HistoryReader:
+    """Reads sensor history from MongoDB, falling back to the archive for old ranges"""
+
+    def __init__(self, db, archiver):
+        self.db = db
+        self.archiver = archiver
+
+    def find_readings(self, user_id, role=None, start=None, end=None, limit=100, projection=None):
+        """Readings newest first, like sensor_data.find().sort('timestamp', -1)
+
+        `projection` is a list of fields to return (plus _id), for MongoDB
+        and archived readings alike.
+        """
+        query = {'user_id': user_id}
+        if role:
+            query['role'] = role
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+
+        results = list(self.db.sensor_data.find(query, projection).sort('timestamp', DESCENDING).limit(limit))
+        if len(results) >= limit or not start:
+            return results
+
+        # Only users with archived readings have anything older in the archive.
+        # Readings still in MongoDB are served from there whether or not
+        # they are archived, so the archive only fills in what has expired
+        state = self.db.archive_state.find_one({'user_id': user_id})
+        archived_until = state.get('archived_until') if state else None
+        if not archived_until or start >= archived_until:
+            return results
+
+        archive_end = min(end, archived_until) if end else archived_until
+        seen = {str(r['_id']) for r in results}
+        for record in self.archiver.read(user_id, start, archive_end, role):
+            # A crashed run can leave a frame for readings it never marked
+            if record['_id'] not in seen:
+                seen.add(record['_id'])
+                if projection:
+                    record = {k: v for k, v in record.items() if k == '_id' or k in projection}
+                results.append(record)
+        results.sort(key=lambda r: r['timestamp'], reverse=True)
+        return results[:limit]
+
+def main():
+    import sys
+    from flask import Flask
+    from flask_pymongo import PyMongo
+    from config import Config
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('archive', 'indexes'):
+        print("Usage: python retention.py archive|indexes")
+        sys.exit(1)
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db = PyMongo(app).db
+
+    ensure_indexes(db, Config.SENSOR_DATA_RETENTION_DAYS, Config.RECOMMENDATIONS_RETENTION_DAYS, Config.ARCHIVE_LEAD_DAYS)
+    if sys.argv[1] == 'archive':
+        archiver = Archiver(db, Config.ARCHIVE_DIR, Config.SENSOR_DATA_RETENTION_DAYS, Config.ARCHIVE_LEAD_DAYS)
+        archiver.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+JSON serialization for API responses and MQTT payloads.
+
+Uses orjson when it is installed, which serializes datetimes natively and
+writes bytes directly; falls back to the standard library otherwise. Both
+paths convert ObjectId to str and datetime to ISO 8601, so Mongo documents
+can be returned as-is without per-row conversion loops.
+"""
+
+import json
+from datetime import date, datetime
+
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+def _default(obj):
+    """Types neither backend handles natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        """Serialize to UTF-8 encoded JSON bytes"""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj):
+        """Serialize to a JSON string"""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(data):
+        """Parse JSON from str or bytes"""
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj):
+        """Serialize to UTF-8 encoded JSON bytes"""
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def dumps(obj):
+        """Serialize to a JSON string"""
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def loads(data):
+        """Parse JSON from str or bytes"""
+        return json.loads(data)
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by this module
+
+    Install with `app.json = FastJSONProvider(app)`; `jsonify` and the
+    `tojson` template filter then go through the fast path.
+    """
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
@@ -0,0 +1,231 @@
+"""
+Lazily created, fork-safe service singletons for the Flask app.
+
+Nothing here touches the network or imports the heavy client libraries
+(pymongo, openai, paho, numpy) until a service is first used. Each service
+remembers the pid it was created in and is rebuilt on first use in a forked
+child, so a pre-fork server never shares a MongoClient, socket or worker
+thread with its parent.
+"""
+
+import os
+import threading
+import weakref
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+EXTENSION_KEY = 'smartcomb'
+
+_lazy_services = weakref.WeakSet()
+
+class LazyService:
+    """Builds its instance with `factory` on first get(), again after a fork"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+        _lazy_services.add(self)
+
+    def get(self):
+        pid = os.getpid()
+        if self._instance is None or self._pid != pid:
+            with self._lock:
+                if self._instance is None or self._pid != pid:
+                    self._instance = self.factory()
+                    self._pid = pid
+        return self._instance
+
+    def override(self, instance):
+        """Use `instance` instead of building one (benchmarks, scripts)"""
+        with self._lock:
+            self._instance = instance
+            self._pid = os.getpid()
+
+    @property
+    def initialized(self):
+        return self._instance is not None and self._pid == os.getpid()
+
+def _reset_locks_in_child():
+    # A lock held by another thread at fork time would never be released
+    for service in list(_lazy_services):
+        service._lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_in_child)
+
+class Services:
+    """The app's MongoDB, OpenAI, MQTT, retention and admission control services
+
+    Attributes (`services.mongo`, `services.openai_service`, ...) build the
+    service on first access. Background threads (MQTT subscriber, index
+    creation, archiving and command publishing) only run after start_background(), normally in
+    the single worker process started by run_worker().
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._services = {
+            'mongo': LazyService(self._create_mongo),
+            'device_registry': LazyService(self._create_device_registry),
+            'openai_service': LazyService(self._create_openai_service),
+            'mqtt_client': LazyService(self._create_mqtt_client),
+            'vibration_downlink': LazyService(self._create_vibration_downlink),
+            'downlink_publisher': LazyService(self._create_downlink_publisher),
+            'archiver': LazyService(self._create_archiver),
+            'history_reader': LazyService(self._create_history_reader),
+            'rate_limiter': LazyService(self._create_rate_limiter),
+            'llm_limiter': LazyService(self._create_llm_limiter),
+        }
+        self._background_lock = threading.Lock()
+        self._background_pid = None
+        self.mqtt_thread = None
+        self.storage_thread = None
+        self.downlink_thread = None
+        app.extensions[EXTENSION_KEY] = self
+
+    def __getattr__(self, name):
+        services = self.__dict__.get('_services', {})
+        if name in services:
+            return services[name].get()
+        raise AttributeError(name)
+
+    def override(self, name, instance):
+        self._services[name].override(instance)
+
+    def initialized(self):
+        return [name for name, service in self._services.items() if service.initialized]
+
+    def _create_mongo(self):
+        from flask_pymongo import PyMongo
+        return PyMongo(self.app)
+
+    def _create_device_registry(self):
+        from device_registry import DeviceRegistry
+        return DeviceRegistry(self.mongo, self.app.config['DEVICE_CACHE_SECONDS'])
+
+    def _create_openai_service(self):
+        from openai_service import OpenAIService
+        return OpenAIService(self.app.config, self.mongo.db.chat_memory)
+
+    def _create_mqtt_client(self):
+        from mqtt_client import MQTTClient
+        return MQTTClient(self.app, self.mongo, self.device_registry)
+
+    def _create_vibration_downlink(self):
+        from downlink import DownlinkQueue
+        return DownlinkQueue(self.mongo.db.downlink_commands)
+
+    def _create_downlink_publisher(self):
+        from downlink import DownlinkPublisher
+        return DownlinkPublisher(
+            self.mongo.db.downlink_commands,
+            self.publish,
+            self.app.config['VIBRATION_DEBOUNCE_MS'] / 1000.0
+        )
+
+    def _create_archiver(self):
+        from retention import Archiver
+        return Archiver(
+            self.mongo.db,
+            self.app.config['ARCHIVE_DIR'],
+            self.app.config['SENSOR_DATA_RETENTION_DAYS'],
+            self.app.config['ARCHIVE_LEAD_DAYS']
+        )
+
+    def _create_history_reader(self):
+        from retention import HistoryReader
+        return HistoryReader(self.mongo.db, self.archiver)
+
+    def _create_rate_limiter(self):
+        from ratelimit import RateLimiter, parse_limit
+        config = self.app.config
+        limits = {}
+        if config['RATE_LIMIT_ENABLED']:
+            limits = {
+                'recommendations': parse_limit(config['RATE_LIMIT_RECOMMENDATIONS']),
+                'chat': parse_limit(config['RATE_LIMIT_CHAT']),
+                'set_role': parse_limit(config['RATE_LIMIT_SET_ROLE']),
+                'vibration': parse_limit(config['RATE_LIMIT_VIBRATION']),
+            }
+        return RateLimiter(limits, config['RATE_LIMIT_STORAGE_URL'] if limits else None)
+
+    def _create_llm_limiter(self):
+        from ratelimit import ConcurrencyLimiter
+        config = self.app.config
+        return ConcurrencyLimiter(
+            config['LLM_MAX_CONCURRENCY'],
+            storage_url=config['RATE_LIMIT_STORAGE_URL'],
+            lease_seconds=config['LLM_LEASE_SECONDS']
+        )
+
+    def publish(self, messages):
+        """Publish a list of {'topic', 'payload', ...} dicts to the broker"""
+        import paho.mqtt.publish as mqtt_publish
+        mqtt_publish.multiple(messages, hostname=self.app.config['MQTT_BROKER'], port=self.app.config['MQTT_PORT'])
+
+    def init_storage(self):
+        """Create the query, TTL and dedup indexes"""
+        from retention import ensure_indexes
+        from dedup import ensure_dedup_index
+        try:
+            ensure_indexes(
+                self.mongo.db,
+                self.app.config['SENSOR_DATA_RETENTION_DAYS'],
+                self.app.config['RECOMMENDATIONS_RETENTION_DAYS'],
+                self.app.config['ARCHIVE_LEAD_DAYS']
+            )
+            ensure_dedup_index(self.mongo.db)
+        except Exception as e:
+            print(f"[STORAGE] Could not create indexes: {e}")
+
+    def _run_storage(self):
+        self.init_storage()
+        if self.app.config['ARCHIVE_INTERVAL'] > 0 and self.app.config['SENSOR_DATA_RETENTION_DAYS'] > 0:
+            self.archiver.run_forever(self.app.config['ARCHIVE_INTERVAL'])
+
+    def start_background(self):
+        """Start the MQTT subscriber, storage and downlink threads, once per process"""
+        pid = os.getpid()
+        if self._background_pid == pid:
+            return
+        with self._background_lock:
+            if self._background_pid == pid:
+                return
+            self._background_pid = pid
+            self.mqtt_thread = threading.Thread(target=self.mqtt_client.start, name='mqtt-client', daemon=True)
+            self.mqtt_thread.start()
+            # Index creation waits for MongoDB, so keep it off the request path
+            self.storage_thread = threading.Thread(target=self._run_storage, name='storage', daemon=True)
+            self.storage_thread.start()
+            self.downlink_thread = threading.Thread(target=self.downlink_publisher.run_forever, name='downlink', daemon=True)
+            self.downlink_thread.start()
+
+    def run_worker(self):
+        """Run the background services in the foreground until the MQTT client stops
+
+        Exactly one worker should run per deployment: each one subscribes to
+        the broker and archives independently. Returns a process exit code.
+        """
+        from diagnostics import install_stack_dump_signal, serve_worker_diagnostics
+        install_stack_dump_signal()
+        if 'diagnostics' in self.app.extensions:
+            serve_worker_diagnostics(self.app, self.app.config['DIAGNOSTICS_WORKER_PORT'])
+        self.start_background()
+        print(f"[WORKER] MQTT subscriber and storage jobs running (pid {os.getpid()})")
+        try:
+            while self.mqtt_thread.is_alive():
+                self.mqtt_thread.join(1)
+        except KeyboardInterrupt:
+            return 0
+        print("[WORKER] MQTT client stopped")
+        return 1
+
+def current_services():
+    return current_app.extensions[EXTENSION_KEY]
+
+def service_proxy(name):
+    """Module-level handle to a service of the current app"""
+    return LocalProxy(lambda: getattr(current_services(), name))
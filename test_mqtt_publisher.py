@@ -10,18 +10,24 @@ import paho.mqtt.client as mqtt
 import json
 import time
 import random
+import uuid
 
 # MQTT Configuration
 BROKER = "broker.hivemq.com"
 PORT = 1883
-TOPIC_SENSORS = "smartcomb/sensors"
-TOPIC_IR = "smartcomb/sensors/ir"
-TOPIC_ROLE = "smartcomb/sensors/role"  # Subscribe to role updates
 
 # Test user ID (replace with actual user_id from your database)
 # Run: python get_user_id.py <username> to get your user_id
 # Or get it from the dashboard after logging in
 USER_ID = "6912bf7e2662f139fcd0db53"  # UPDATE THIS with your actual user_id
+# device_id is unique across the deployment, so derive it from the user
+DEVICE_ID = f"testpub-{USER_ID[-6:]}"  # Register this under "Your combs" on the dashboard
+
+# Per-device topics: smartcomb/{user_id}/{device_id}/...
+TOPIC_PREFIX = f"smartcomb/{USER_ID}/{DEVICE_ID}"
+TOPIC_SENSORS = f"{TOPIC_PREFIX}/sensors"
+TOPIC_IR = f"{TOPIC_PREFIX}/sensors/ir"
+TOPIC_ROLE = f"{TOPIC_PREFIX}/role"  # Subscribe to role updates
 
 # Current role (will be updated via MQTT from website)
 current_role = "mother"  # Default role, will be updated when website sends role
@@ -41,6 +47,7 @@ def publish_sensor_data(client):
     if ir_value == 1:
         # Only publish other sensors when combing is detected
         sensor_data = {
+            "msg_id": uuid.uuid4().hex,  # Lets the server drop redeliveries
             "user_id": USER_ID,
             "role": current_role,  # Use current role (updated from website)
             "temperature": round(random.uniform(20.0, 35.0), 1),  # DS18B20 temperature
@@ -106,14 +113,16 @@ def main():
     print("Smart Comb - MQTT Test Publisher")
     print("=" * 60)
     print(f"User ID: {USER_ID}")
+    print(f"Device ID: {DEVICE_ID}")
     print(f"Initial Role: {current_role}")
     print(f"Broker: {BROKER}:{PORT}")
     print("=" * 60)
     print("\nInstructions:")
     print("1. Make sure USER_ID is set to your actual user_id from dashboard")
-    print("2. Select a role (mother/father/child) on the website dashboard")
-    print("3. This script will receive the role update and publish data with that role")
-    print("4. Press Ctrl+C to stop\n")
+    print(f"2. Register device ID '{DEVICE_ID}' under \"Your combs\" on the dashboard")
+    print("3. Select a role (mother/father/child) on the website dashboard")
+    print("4. This script will receive the role update and publish data with that role")
+    print("5. Press Ctrl+C to stop\n")
     
     client = mqtt.Client()
     client.on_connect = on_connect
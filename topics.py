@@ -0,0 +1,46 @@
+"""
+MQTT topic layout.
+
+Every device gets its own namespace under the user that owns it:
+
+    smartcomb/{user_id}/{device_id}/sensors      device -> server readings
+    smartcomb/{user_id}/{device_id}/sensors/ir   device -> server combing state
+    smartcomb/{user_id}/{device_id}/role         server -> device role selection
+    smartcomb/{user_id}/{device_id}/vibration    server -> device motor control
+
+The server subscribes with wildcards and reads the user/device from the
+topic, so the broker does the routing and each comb only receives its own
+commands. The topic is not authenticated on a public broker, so the user id
+is validated here and the device must be registered to that user (see
+DeviceRegistry.claim).
+"""
+
+import re
+
+USER_ID_PATTERN = re.compile(r'[0-9a-f]{24}')
+
+SENSORS = 'sensors'
+IR = 'sensors/ir'
+ROLE = 'role'
+VIBRATION = 'vibration'
+
+def is_user_id(value):
+    """True for a user id as issued at signup (an ObjectId string)"""
+    return isinstance(value, str) and USER_ID_PATTERN.fullmatch(value) is not None
+
+def device_topic(root, user_id, device_id, channel):
+    return f"{root}/{user_id}/{device_id}/{channel}"
+
+def server_subscriptions(root):
+    """Wildcard subscriptions covering uplink topics for every device"""
+    return [f"{root}/+/+/{SENSORS}", f"{root}/+/+/{IR}"]
+
+def parse_topic(root, topic):
+    """Split a device topic into (user_id, device_id, channel), or None if it is not one"""
+    prefix = root + '/'
+    if not topic.startswith(prefix):
+        return None
+    parts = topic[len(prefix):].split('/', 2)
+    if len(parts) != 3 or not is_user_id(parts[0]) or not parts[1]:
+        return None
+    return parts[0], parts[1], parts[2]